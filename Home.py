@@ -1,29 +1,27 @@
 import asyncio
 import os
 from dotenv import load_dotenv
-import pickle
 
 import pandas as pd
-import httpx
 import xgboost as xgb
 
 import streamlit as st
 from streamlit_option_menu import option_menu
 from stqdm import stqdm
 
-# enhanced wzlight/Api child cls to boost some wzlight client methods (caching etc.)
+# enhanced wzlight/Api child cls to boost some wzlight client methods (caching etc.), run as a service
 # from wzlight import Api
-from src.enhance import EnhancedApi
+from src.service import get_service
+from src.frames import get_frames
 
 
 from src import (
     utils,
-    api_format,
+    collect,
     match_details,
     sessions_history,
     kd_history,
     profile_details,
-    session_details,
     predict,
 )
 
@@ -37,14 +35,19 @@ import rendering
 load_dotenv()
 sso = os.environ["SSO"] or st.secrets("SSO")
 
-# Wzlight api is enhanced (tweaks, caching etc..) in a separate Cls in enhance.py module
-enh_api = EnhancedApi(sso)
-
 # Load labels and global app behavior settings : run in offline mode, formatting & display options
 PLATFORMS = {"Bnet": "battle", "Xbox": "xbox", "Psn": "psn", "Acti": "acti"}
 CONF = utils.load_conf()
 LABELS = utils.load_labels()
 
+# Wzlight api is enhanced (tweaks, caching etc..) in a separate Cls in enhance.py module
+# It runs in a process-wide service (one pooled httpx client, background event loop) shared by all sessions,
+# so reruns do not rebuild it. API responses are persisted on disk (src/cache.py)
+enh_api = get_service(sso, CONF)
+
+# Frames (flattened matches, session aggregations) run on pandas or Polars, see src/frames.py
+frames = get_frames(CONF)
+
 
 # ------------------------------------ Streamlit App Layout -----------------------------------------
 
@@ -125,253 +128,320 @@ async def main():
     # Could also use isLogged session state, but we're saving some options
     if st.session_state.user:
         platform = PLATFORMS.get(platform)
+        max_calls = 5
+
+        # Every API call of the page is started at once (profile, history, last session),
+        # results are awaited below, where they are rendered. See src/collect.py
+        if not CONF["APP_BEHAVIOR"]["mode"] == "offline":
+            page_data = collect.PageData(
+                enh_api,
+                platform,
+                username,
+                max_calls=max_calls,
+                sessions=sessions_history.SessionIndex.from_conf(CONF),
+            )
 
-        # httpx client (to use with wzlight COD API wrapper) as a context manager :
-        async with httpx.AsyncClient() as httpxClient:
-            # ----------------------------------------------------------#
-            # Search profile                                            #
-            # ----------------------------------------------------------#
-
-            # tmp patch to offline mode (load saved API responses), WZ1 API/data partly discontinued
-            if not CONF["APP_BEHAVIOR"]["mode"] == "offline":
-                profile = await enh_api.GetProfile(httpxClient, platform, username)
-            else:
-                with open("data/sample_profile.pkl", "rb") as f:
-                    profile = pickle.load(f)
-
-            # Check if callofduty profile exists (key "message" in COD API response dict."), else st.stop()
-            if "message" in list(profile.keys()):
-                st.warning(
-                    f"Wrong platform and/or User ID ({username}). For working examples, try : (gentilrenard#2939, Bnet), (amadevs#1689, Bnet), (nicoyzovitch, Psn)"
-                )
-                st.stop()
+        # ----------------------------------------------------------#
+        # Search profile                                            #
+        # ----------------------------------------------------------#
 
-            # If profile valid, carry on
-            profile_kpis = profile_details.get_kpis_profile(profile)
-            lifetime_kd = profile_kpis["br_kd"]
-            lifetime_kills_ratio = profile_kpis["br_kills_ratio"]
-
-            # add a little Scorecard 'Profile' in Sidebar, under Search fields
-            with st.sidebar:
-                st.subheader("Profile")
-                username_short = username.split("#")[0]
-                with st.expander(
-                    f"{username_short} | lvl {profile_kpis['level']} | {profile_kpis['matches_count_all']} matches",
-                    False,
-                ):
-                    col1, col2, col3 = st.columns((0.5, 0.5, 0.5))
-                    with col1:
-                        st.metric(
-                            label="% mode br",
-                            value=f"{profile_kpis['competitive_ratio']}%",
-                        )
-                    with col2:
-                        st.metric(label="k/d br", value=lifetime_kd)
+        # tmp patch to offline mode (load saved API responses), WZ1 API/data partly discontinued
+        if not CONF["APP_BEHAVIOR"]["mode"] == "offline":
+            profile = await page_data.profile
+        else:
+            profile = collect.load_offline("profile")
 
-                    with col3:
-                        st.metric(label="kills avg br", value=lifetime_kills_ratio)
+        # Check if callofduty profile exists (key "message" in COD API response dict."), else st.stop()
+        if "message" in list(profile.keys()):
+            st.warning(
+                f"Wrong platform and/or User ID ({username}). For working examples, try : (gentilrenard#2939, Bnet), (amadevs#1689, Bnet), (nicoyzovitch, Psn)"
+            )
+            st.stop()
+
+        # If profile valid, carry on
+        profile_kpis = profile_details.get_kpis_profile(profile)
+        lifetime_kd = profile_kpis["br_kd"]
+        lifetime_kills_ratio = profile_kpis["br_kills_ratio"]
+
+        # add a little Scorecard 'Profile' in Sidebar, under Search fields
+        with st.sidebar:
+            st.subheader("Profile")
+            username_short = username.split("#")[0]
+            with st.expander(
+                f"{username_short} | lvl {profile_kpis['level']} | {profile_kpis['matches_count_all']} matches",
+                False,
+            ):
+                col1, col2, col3 = st.columns((0.5, 0.5, 0.5))
+                with col1:
+                    st.metric(
+                        label="% mode br",
+                        value=f"{profile_kpis['competitive_ratio']}%",
+                    )
+                with col2:
+                    st.metric(label="k/d br", value=lifetime_kd)
+
+                with col3:
+                    st.metric(label="kills avg br", value=lifetime_kills_ratio)
+
+        # Automatically close the Sidebar
+        # if st.session_state.sidebar_state == "expanded":
+        #    st.session_state.sidebar_state == "collapsed"
+        #    st.experimental_rerun()
+
+        # Create 2 containers, later filled-in with charts/tables, once we collected recent matches history
+        cont_stats_history = st.container()
+        cont_last_session = st.container()
+
+        # ----------------------------------------------------------#
+        # Matches (to Sessions) History                             #
+        # ----------------------------------------------------------#
+
+        # Get recent matches (history)
+        st.markdown("**Play Sessions History**")
+
+        # tmp patch to offline mode (load saved API responses), WZ1 API/data partly discontinued
+        if not CONF["APP_BEHAVIOR"]["mode"] == "offline":
+            with st.spinner(
+                f"Recent matches history : collecting last {max_calls *20} matches..."
+            ):
+                recent_matches = await page_data.history
+            if page_data.degraded:
+                st.warning("COD API is unavailable, showing saved (offline) data")
+        else:
+            with st.spinner(
+                f"Recent matches history : collecting last {max_calls *20} matches..."
+            ):
+                recent_matches = collect.load_offline("recent_matches")
+
+        # in-game gamertag can be different from api username
+        gamertag = utils.get_gamertag(recent_matches)
+
+        # Sessions (gap between 2 consecutive matches > 1 hour), indexed once for every use below
+        # (online : page after page, as history was collected)
+        if not CONF["APP_BEHAVIOR"]["mode"] == "offline":
+            sessions = page_data.sessions
+        else:
+            sessions = sessions_history.SessionIndex.from_conf(CONF).update(
+                recent_matches
+            )
 
-            # Automatically close the Sidebar
-            # if st.session_state.sidebar_state == "expanded":
-            #    st.session_state.sidebar_state == "collapsed"
-            #    st.experimental_rerun()
+        # Extract last session match ids, for the last played match type (br/resu only)*
+        last_type_ids = sessions.last_session_ids()
 
-            # Create 2 containers, later filled-in with charts/tables, once we collected recent matches history
-            cont_stats_history = st.container()
-            cont_last_session = st.container()
+        # Extract last game type (br or resu) played to know if we can apply our model
+        # to predict avg lobby kd for our last *resurgence* matches
+        last_type_played = sessions.last_session_type()
 
-            # ----------------------------------------------------------#
-            # Matches (to Sessions) History                             #
-            # ----------------------------------------------------------#
+        # API results are flattened, reshaped/formated, augmented (e.g. gulag W/L entry)
+        recent_matches = frames.res_to_df(recent_matches, CONF)
+        recent_matches = frames.format_df(recent_matches, CONF, LABELS)
+        recent_matches = frames.augment_df(recent_matches, LABELS)
+        # sessions & kd history run on pandas
+        recent_matches = frames.to_pandas(recent_matches)
 
-            # Get recent matches (history)
-            st.markdown("**Play Sessions History**")
-            max_calls = 5
+        # Reshape our matches to a "sessions history" (gap between 2 consecutive matches > 1 hour)
+        # Perform stats aggregations for each session, then render with st.aggrid
+        df_sessions_history = sessions_history.to_history(
+            recent_matches, CONF, LABELS, sessions=sessions
+        )
+        stats_sessions_history = sessions_history.stats_per_session(df_sessions_history)
+
+        # Render each session and their stats in a stacked-two-columns layout
+        # It's better to avoid rendering multi indexes tables in St, so we split them given their session idx
+        sessions_indexes = df_sessions_history.session.unique().tolist()
+        history_grouped = df_sessions_history.groupby("session")
+        for idx in sessions_indexes:
+            dict_ = stats_sessions_history.get(idx)
+            df_session = history_grouped.get_group(idx)
+            col1, col2 = st.columns((0.2, 0.8))
+            with col1:
+                rendering.sessions_history_legend(dict_)
+            with col2:
+                rendering.sessions_history_table(df_session, CONF)
+
+        # ----------------------------------------------------------#
+        # Performance History ("kd history")                        #
+        # ----------------------------------------------------------#
+
+        # Recent matches are split in 3 types (br, resu, others), in 3 separate tabs
+        # They're stored in a 3-entries-dict so we won't filter afterwards & the app does not rerun
+        data = utils.partition_history(recent_matches, LABELS)
+        # cumulative / moving stats, once per type, for the charts
+        # resumed from the previous refresh (KPIs store), only new matches are computed
+        kd_histories = kd_history.to_histories(
+            data, store=enh_api.kpis, player=(platform, username)
+        )
+        # opt-in (conf.toml kpi_sync) : cumulative KPIs then span every match seen, charts say so
+        kpis_synced = enh_api.kpis is not None
+
+        # store last n games final-cumulative KD for each game mode in a dict, for future benchmarks
+        # from the displayed matches : synced KPIs (kpi_sync) span every match seen for the player
+        cum_kd = kd_history.extract_last_cum_kd(data)
+        st.write(cum_kd)
+
+        with cont_stats_history:
+            st.markdown("**Performance History**")
+
+            # We want the first tab to be the most played game mode : BR or Resurgence or Others
+            sort_idx = [(k, len(v)) for k, v in data.items()]
+            sorted_labels = sorted(sort_idx, key=lambda x: x[1], reverse=True)
+            sorted_labels = [t[0] for t in sorted_labels]
+
+            tab1, tab2, tab3 = st.tabs(sorted_labels)
+
+            # For every game mode, render charts in a separate tab :
+            # 1 main chart (kd) on top of 2 or 3 smaller charts, organized in columns
+            for tab, tab_label in zip([tab1, tab2, tab3], sorted_labels):
+                with tab:
+                    # if enough data points for this game mode :
+                    if len(data[tab_label]) >= 2:
+                        # main chart : K/D history scatter line
+                        df_kd_history = kd_histories[tab_label]
+                        rendering.history_kd(df_kd_history, synced=kpis_synced)
+
+                        if not tab_label == "Battle Royale":
+                            # small charts : Cumulative / avg given indicator, 2 cols layout
+                            col1, col2 = st.columns((0.5, 0.5))
+                            with col1:
+                                rendering.history_kd_small(
+                                    df_kd_history, col="killsCumAvg", synced=kpis_synced
+                                )
+                            with col2:
+                                rendering.history_kd_small(
+                                    df_kd_history,
+                                    col="damageDoneCumAvg",
+                                    synced=kpis_synced,
+                                )
+                        else:
+                            # small charts : Cumulative / avg given indicator, 3 cols layout
+                            col1, col2, col3 = st.columns((0.5, 0.5, 0.5))
+                            with col1:
+                                rendering.history_kd_small(
+                                    df_kd_history, col="killsCumAvg", synced=kpis_synced
+                                )
+                            with col2:
+                                rendering.history_kd_small(
+                                    df_kd_history,
+                                    col="damageDoneCumAvg",
+                                    synced=kpis_synced,
+                                )
+                            with col3:
+                                rendering.history_kd_small(
+                                    df_kd_history, col="gulagWinPct", synced=kpis_synced
+                                )
+                    else:
+                        st.caption("Not enough matches played in recent history")
+
+        # ----------------------------------------------------------#
+        # Last Session Details                                      #
+        # ----------------------------------------------------------#
+
+        with cont_last_session:
+            # Title + "fake" refresh button to rerun the loop and get the very latest matches
+            col1, col2 = st.columns((9, 1))
+            with col1:
+                st.markdown("**Most recent Battle Royale / Resurgence session**")
+            with col2:
+                st.button("Refresh")
 
             # tmp patch to offline mode (load saved API responses), WZ1 API/data partly discontinued
             if not CONF["APP_BEHAVIOR"]["mode"] == "offline":
-                with st.spinner(
-                    f"Recent matches history : collecting last {max_calls *20} matches..."
-                ):
-                    recent_matches = await enh_api.GetRecentMatchesWithDateLoop(
-                        httpxClient, platform, username, max_calls=max_calls
-                    )
+                # matches are streamed as they are collected (fastest first, requested as soon as
+                # history first page was received) : player's stats for every match already received
+                # are shown, until the whole session is rendered below
+                with st.spinner("Collecting every match of last session..."):
+                    progress = st.empty()
+                    collected = {}
+                    player_matches = []
+                    async for match in page_data.last_session_matches():
+                        if not match:
+                            continue
+                        collected[str(match[0]["matchID"])] = match
+                        df_match = frames.res_to_df(match, CONF)
+                        df_match = frames.format_df(df_match, CONF, LABELS)
+                        player_matches.append(
+                            frames.to_pandas(frames.player_stats(df_match, gamertag))
+                        )
+                        progress.dataframe(pd.concat(player_matches))
+                    progress.empty()
+                # back to last session matches order (most recent first)
+                last_session = [
+                    player
+                    for match_id in last_type_ids
+                    for player in collected.get(str(match_id), [])
+                ]
             else:
-                with st.spinner(
-                    f"Recent matches history : collecting last {max_calls *20} matches..."
-                ):
-                    with open("data/sample_recent_matches.pkl", "rb") as f:
-                        recent_matches = pickle.load(f)
-
-            # in-game gamertag can be different from api username
-            gamertag = utils.get_gamertag(recent_matches)
-
-            # Extract last session match ids, for the last played match type (br/resu only)*
-            last_type_ids = utils.get_last_session_ids(recent_matches)
-
-            # Extract last game type (br or resu) played to know if we can apply our model
-            # to predict avg lobby kd for our last *resurgence* matches
-            last_type_played = utils.get_last_session_type(recent_matches)
-
-            # API results are flattened, reshaped/formated, augmented (e.g. gulag W/L entry)
-            recent_matches = api_format.res_to_df(recent_matches, CONF)
-            recent_matches = api_format.format_df(recent_matches, CONF, LABELS)
-            recent_matches = api_format.augment_df(recent_matches, LABELS)
-
-            # Reshape our matches to a "sessions history" (gap between 2 consecutive matches > 1 hour)
-            # Perform stats aggregations for each session, then render with st.aggrid
-            df_sessions_history = sessions_history.to_history(
-                recent_matches, CONF, LABELS
-            )
-            stats_sessions_history = sessions_history.stats_per_session(
-                df_sessions_history
-            )
-
-            # Render each session and their stats in a stacked-two-columns layout
-            # It's better to avoid rendering multi indexes tables in St, so we split them given their session idx
-            sessions_indexes = df_sessions_history.session.unique().tolist()
-            history_grouped = df_sessions_history.groupby("session")
-            for idx in sessions_indexes:
-                dict_ = stats_sessions_history.get(idx)
-                df_session = history_grouped.get_group(idx)
-                col1, col2 = st.columns((0.2, 0.8))
-                with col1:
-                    rendering.sessions_history_legend(dict_)
-                with col2:
-                    rendering.sessions_history_table(df_session, CONF)
-
-            # ----------------------------------------------------------#
-            # Performance History ("kd history")                        #
-            # ----------------------------------------------------------#
-
-            # Recent matches are split in 3 types (br, resu, others), in 3 separate tabs
-            # They're stored in a 3-entries-dict so we won't filter afterwards & the app does not rerun
-            data = {}
-            types = ["Battle Royale", "Resurgence", "Others"]
-            for type_ in types:
-                data[type_] = utils.filter_history(recent_matches, LABELS, select=type_)
-
-            # store last n games final-cumulative KD for each game mode in a dict, for future benchmarks
-            cum_kd = kd_history.extract_last_cum_kd(data)
-            st.write(cum_kd)
-
-            with cont_stats_history:
-                st.markdown("**Performance History**")
-
-                # We want the first tab to be the most played game mode : BR or Resurgence or Others
-                sort_idx = [(k, len(v)) for k, v in data.items()]
-                sorted_labels = sorted(sort_idx, key=lambda x: x[1], reverse=True)
-                sorted_labels = [t[0] for t in sorted_labels]
-
-                tab1, tab2, tab3 = st.tabs(sorted_labels)
-
-                # For every game mode, render charts in a separate tab :
-                # 1 main chart (kd) on top of 2 or 3 smaller charts, organized in columns
-                for tab, tab_label in zip([tab1, tab2, tab3], sorted_labels):
-                    with tab:
-                        # if enough data points for this game mode :
-                        if len(data[tab_label]) >= 2:
-                            # main chart : K/D history scatter line
-                            df_kd_history = kd_history.to_history(data.get(tab_label))
-                            rendering.history_kd(df_kd_history)
-
-                            if not tab_label == "Battle Royale":
-                                # small charts : Cumulative / avg given indicator, 2 cols layout
-                                col1, col2 = st.columns((0.5, 0.5))
-                                with col1:
-                                    rendering.history_kd_small(
-                                        df_kd_history, col="killsCumAvg"
-                                    )
-                                with col2:
-                                    rendering.history_kd_small(
-                                        df_kd_history, col="damageDoneCumAvg"
-                                    )
-                            else:
-                                # small charts : Cumulative / avg given indicator, 3 cols layout
-                                col1, col2, col3 = st.columns((0.5, 0.5, 0.5))
-                                with col1:
-                                    rendering.history_kd_small(
-                                        df_kd_history, col="killsCumAvg"
-                                    )
-                                with col2:
-                                    rendering.history_kd_small(
-                                        df_kd_history, col="damageDoneCumAvg"
-                                    )
-                                with col3:
-                                    rendering.history_kd_small(
-                                        df_kd_history, col="gulagWinPct"
-                                    )
-                        else:
-                            st.caption("Not enough matches played in recent history")
+                with st.spinner("Collecting every match of last session..."):
+                    last_session = collect.load_offline("last_session")
 
-            # ----------------------------------------------------------#
-            # Last Session Details                                      #
-            # ----------------------------------------------------------#
+            # COD API went down while collecting them (history was live : no offline session to match it)
+            if not last_session:
+                st.warning(
+                    "Last session matches are unavailable (COD API is down), try again later"
+                )
+                st.stop()
 
-            with cont_last_session:
-                # Title + "fake" refresh button to rerun the loop and get the very latest matches
-                col1, col2 = st.columns((9, 1))
-                with col1:
-                    st.markdown("**Most recent Battle Royale / Resurgence session**")
-                with col2:
-                    st.button("Refresh")
+            # Predict Resurgence Lobby KD (XGBoost model : from matches stats, not actual players' k/d ratios)
+            # if our last match are of type Resurgence, else create a df with an empty 'lobby kd" column
+            if last_type_played == "resurgence":
+                # stored per match : predicted once for every player of the lobby, and every rerun
+                df_predicted_kd = predict.lobby_kd(last_session, store=enh_api.lobby_kd)
+            else:
+                n_matches = len(list(set([dict_["matchID"] for dict_ in last_session])))
+                df_predicted_kd = pd.DataFrame({"Lobby KD": ["-"] * n_matches})
 
-                # tmp patch to offline mode (load saved API responses), WZ1 API/data partly discontinued
-                if not CONF["APP_BEHAVIOR"]["mode"] == "offline":
-                    with st.spinner("Collecting every match of last session..."):
-                        last_session = await enh_api.GetMatchList(
-                            httpxClient, platform, last_type_ids
-                        )
-                else:
-                    with st.spinner("Collecting every match of last session..."):
-                        with open("data/sample_last_session.pkl", "rb") as f:
-                            last_session = pickle.load(f)
-
-                # Predict Resurgence Lobby KD (XGBoost model : from matches stats, not actual players' k/d ratios)
-                # if our last match are of type Resurgence, else create a df with an empty 'lobby kd" column
-                if last_type_played == "resurgence":
-                    df_encoded = predict.pipeline_transform(last_session)
-                    df_predicted_kd = predict.predict_lobby_kd(df_encoded)
-                else:
-                    n_matches = len(
-                        list(set([dict_["matchID"] for dict_ in last_session]))
-                    )
-                    df_predicted_kd = pd.DataFrame({"Lobby KD": ["-"] * n_matches})
+            # API matches stats are flattened, reshaped/formated, augmented (e.g. gulag W/L entry)
+            last_session = frames.res_to_df(last_session, CONF)
+            last_session = frames.format_df(last_session, CONF, LABELS)
+            last_session = frames.augment_df(last_session, LABELS)
 
-                # API matches stats are flattened, reshaped/formated, augmented (e.g. gulag W/L entry)
-                last_session = api_format.res_to_df(last_session, CONF)
-                last_session = api_format.format_df(last_session, CONF, LABELS)
-                last_session = api_format.augment_df(last_session, LABELS)
+            # last session matches, player stats with predicted Lobby KD appended
+            n_last_matches = 3
+            df_player = frames.to_pandas(frames.player_stats(last_session, gamertag))
 
-                # last session matches, player stats with predicted Lobby KD appended
-                n_last_matches = 3
-                df_player = session_details.player_stats(last_session, gamertag)
+            # render Lobbies KD + players stats & player performance bullet chart
+            st.caption(
+                f"Session KD vs. last 100 games (threshold), median/mean all players this session (ticks)"
+            )
+            st.caption(
+                f"A session consists of several matches played consecutively (< 1h in-between matches)"
+            )
+            rendering.session_details_bullet_chart(
+                frames.to_pandas(last_session), gamertag, last_type_played, cum_kd
+            )
 
-                # render Lobbies KD + players stats & player performance bullet chart
-                st.caption(
-                    f"Session KD vs. last 100 games (threshold), median/mean all players this session (ticks)"
-                )
-                st.caption(
-                    f"A session consists of several matches played consecutively (< 1h in-between matches)"
-                )
-                rendering.session_details_bullet_chart(
-                    last_session, gamertag, last_type_played, cum_kd
-                )
+            st.caption(
+                f"Last {n_last_matches} matches estimated Lobby KD. The K/D is predicted by a model taking into account players' performance patterns"
+            )
+            rendering.session_details_player_matches(
+                df_player, df_predicted_kd, CONF, n_last_matches
+            )
 
-                st.caption(
-                    f"Last {n_last_matches} matches estimated Lobby KD. The K/D is predicted by a model taking into account players' performance patterns"
-                )
-                rendering.session_details_player_matches(
-                    df_player, df_predicted_kd, CONF, n_last_matches
-                )
+            # every match of the session at once (one grouped pass) : placement, team kills share & rank in the lobby
+            lobbies = match_details.lobby_analytics(
+                frames.to_pandas(last_session), gamertag, LABELS
+            )
+            st.caption(
+                "Session matches : team kills (% of the lobby kills) and kills rank among the lobby teams"
+            )
+            rendering.session_details_matches(lobbies["matches"], CONF)
+
+            # last session matches stats are aggregated at last session, team level : session k/d, Best Loadout, KDA...
+            # gamertag's teams rows, matched once : matches played together per teammate, then their stats
+            team_session = frames.team_rows(last_session, gamertag)
+            coplay = frames.coplay_counts(team_session)
+            team_stats = frames.to_pandas(
+                frames.team_aggregated_stats(team_session, coplay)
+            )
+            st.caption("Team aggregated stats:")
+            rendering.session_details_aggregated(team_stats, gamertag, CONF)
 
-                # last session matches stats are aggregated at last session, team level : session k/d, Best Loadout, KDA...
-                teammates = session_details.get_teammates(last_session, gamertag)
-                team_stats = session_details.team_aggregated_stats(
-                    last_session, teammates
-                )
-                st.caption("Team aggregated stats:")
-                rendering.session_details_aggregated(team_stats, gamertag, CONF)
+            # same aggregation for whole lobbies : every squad of the session matches, last match first
+            squads_stats = frames.to_pandas(
+                frames.squads_aggregated_stats(last_session)
+            )
+            with st.expander("Every squad of the session lobbies", False):
+                rendering.session_details_squads(squads_stats, gamertag, CONF)
 
 
 if __name__ == "__main__":
@@ -272,6 +272,149 @@ def session_details_player_matches(df_player, df_with_kd, CONF, n_last_matches):
     )  # True, to bypass width setting and fit to st layout
 
 
+def session_details_matches(matches, CONF):
+    """Plotly rendering layer to last session matches, player's team within each lobby, as a table"""
+
+    # tighter our data(frame)
+    matches = matches.copy()
+    matches["K D A"] = utils.concat_cols(
+        matches, to_concat=["kills", "deaths", "assists"], sep=" | "
+    )
+    matches["Team kills"] = [
+        f"{kills} ({share:.0f} %)"
+        for kills, share in zip(matches["teamKills"], matches["teamKillsShare"])
+    ]
+    # killsRank 0 : most kills of the lobby
+    matches["Kills rank"] = matches["teamKillsRank"] + 1
+    # change date format before Plotly renders, because d3 format doesnt deal with dates
+    matches["utcEndSeconds"] = matches["utcEndSeconds"].apply(
+        lambda x: x.strftime("%H.%M")
+    )
+
+    # Rename our columns according to CONF file
+    matches = matches.rename(columns=CONF.get("APP_DISPLAY").get("labels"))
+
+    fig = go.Figure(
+        data=[
+            go.Table(
+                columnwidth=[5, 8, 3, 8, 8, 5, 5],
+                header=dict(
+                    values=[
+                        "<b>Ended at</b>",
+                        "<b>Mode</b>",
+                        "<b>#</b>",
+                        "<b>K D A</b>",
+                        "<b>Team kills</b>",
+                        "<b>Kills rank</b>",
+                        "<b>Lobby kills</b>",
+                    ],  # header cols names, rename here if wanted
+                    align=["left"],
+                    line_color="lightgrey",
+                    fill_color="#F5F7F7",
+                    font=dict(color="#767783", size=14),
+                    height=28,
+                ),
+                cells=dict(
+                    values=[
+                        matches["Ended at"],
+                        matches["Mode"],
+                        matches["#"],
+                        matches["K D A"],
+                        matches["Team kills"],
+                        matches["Kills rank"],
+                        matches["lobbyKills"],
+                    ],
+                    align="left",
+                    fill_color=["rgb(255,255,255)"],
+                    line_color="lightgrey",
+                    font_size=14,
+                    height=25,
+                ),
+            )
+        ]
+    )
+
+    # to narrow spaces between several figures / components
+    height = len(matches) * 30 + 45
+    fig.update_layout(width=600, height=height, margin=dict(l=1, r=0, b=0, t=1))
+
+    config = {"displayModeBar": False}
+    st.plotly_chart(
+        fig, use_container_width=True, config=config
+    )  # True, to bypass width setting and fit to st layout
+
+
+def session_details_squads(squads, gamertag, CONF):
+    """Plotly rendering layer to every squad of last session lobbies (session_details.squads_aggregated_stats), as a table"""
+
+    # tighter our data(frame)
+    squads = squads.copy()
+    squads["K D A"] = utils.concat_cols(
+        squads, to_concat=["kills", "deaths", "assists"], sep=" | "
+    )
+    # change date format before Plotly renders, because d3 format doesnt deal with dates
+    squads["utcEndSeconds"] = squads["utcEndSeconds"].apply(
+        lambda x: x.strftime("%H.%M")
+    )
+    # gamertag's squads highlighted
+    font_color = [
+        "rgb(230,10,120)" if gamertag in players.split(" | ") else "#31333F"
+        for players in squads["players"].tolist()
+    ]
+
+    # Rename our columns according to CONF file
+    squads = squads.rename(columns=CONF.get("APP_DISPLAY").get("labels"))
+
+    fig = go.Figure(
+        data=[
+            go.Table(
+                columnwidth=[5, 3, 20, 4, 6, 12],
+                header=dict(
+                    values=[
+                        "<b>Ended at</b>",
+                        "<b>#</b>",
+                        "<b>Squad</b>",
+                        "<b>KD</b>",
+                        "<b>K D A</b>",
+                        "<b> Best Loadout</b>",
+                    ],  # header cols names, rename here if wanted
+                    align=["left"],
+                    line_color="lightgrey",
+                    fill_color="#F5F7F7",
+                    font=dict(color="#767783", size=14),
+                    height=28,
+                ),
+                cells=dict(
+                    values=[
+                        squads["Ended at"],
+                        squads["#"],
+                        squads["players"],
+                        squads["KD"],
+                        squads["K D A"],
+                        squads["loadoutBest"],
+                    ],
+                    align="left",
+                    format=["", "", "", ".2f", "", ""],  # d3 format
+                    fill_color=["rgb(255,255,255)"],
+                    line_color="lightgrey",
+                    font_color=[font_color],
+                    font_size=14,
+                    height=25,
+                ),
+            )
+        ]
+    )
+
+    # every lobby of the session : a scrollable table, not a page long one
+    height = min(len(squads) * 30 + 45, 600)
+    fig.update_layout(width=600, height=height, margin=dict(l=1, r=0, b=0, t=1))
+
+    config = {"displayModeBar": False}
+    st.plotly_chart(
+        fig, use_container_width=True, config=config
+    )  # True, to bypass width setting and fit to st layout
+
+
 def session_details_bullet_chart(
     last_session_formatted, gamertag, last_type_played, cum_kd
 ):
@@ -474,11 +617,17 @@ Rendering charts with Plotly
 """
 
 
-def history_kd(df):
-    """Render KD and Cumulative KD of last matches"""
+def history_kd(df, synced=False):
+    """Render KD and Cumulative KD of last matches
+
+    synced : cumulative KPIs span every match seen for the player (conf.toml kpi_sync), labelled as such
+    """
 
     y_axis = ["kdRatioRollAvg", "kdRatioCum"]
-    labels = ["Mov. avg (5)", "cumulative"]
+    labels = [
+        "Mov. avg (5)",
+        "cumulative, every match seen" if synced else "cumulative",
+    ]
     colors = ["rgb(204, 204, 204)", "rgb(230,10,120)"]
 
     mode_size = [12, 8]  # node size
@@ -561,7 +710,8 @@ def history_kd(df):
             y=-0.1,
             xanchor="center",
             yanchor="top",
-            text="n last matches",
+            text="n last matches"
+            + (" (cumulative k/d : every match seen)" if synced else ""),
             font=dict(family="Arial", size=11, color="rgb(150,150,150)"),
             showarrow=False,
         )
@@ -591,8 +741,11 @@ def history_kd(df):
     )  # True if you wantr to bypass width setting
 
 
-def history_kd_small(df, col):
-    """Render KD and Cumulative KD of last matches as Plotly Scatter lines"""
+def history_kd_small(df, col, synced=False):
+    """Render KD and Cumulative KD of last matches as Plotly Scatter lines
+
+    synced : cumulative KPIs span every match seen for the player (conf.toml kpi_sync), labelled as such
+    """
 
     axis_labels = {
         "killsCumAvg": "kills avg",
@@ -661,7 +814,7 @@ def history_kd_small(df, col):
             bgcolor="#F5F7F7",
             borderpad=2,
             borderwidth=2,
-            text=f"{axis_labels.get(col)}: {round(df[col].iat[-1],2)}",
+            text=f"{axis_labels.get(col)}{' (all seen)' if synced else ''}: {round(df[col].iat[-1],2)}",
             font=dict(family="Arial", size=13, color="rgb(37,37,37)"),
             showarrow=False,
         )
@@ -1,4 +1,7 @@
 import datetime
+import functools
+import logging
+import re
 from datetime import datetime, timezone
 from doctest import DocFileCase
 import pandas as pd
@@ -14,42 +17,175 @@ Module overall purpose is to flatten COD API matche(s) result to a maximum, into
 Then make data readable & useable for future display / aggregations
 """
 
-
-def extract_loadouts(df, CONF):
-    """Extract player(s) loadout(s) from match(es) df > player col > 'loadout' (or 'loadouts')
-
-    Flatten (breakdown) them into one or several cols : one for every loadout
-    n of loadouts to extract defined in conf.toml
+logger = logging.getLogger(__name__)
+
+
+# Nested entries of a match(es) API result, flattened into columns, in this order
+# (path to the entry, how it is flattened, dtype of its columns)
+# - "fields" : one column per key (first seen first), but keys flattened by another level
+# - "loadouts" : 'loadout' (or 'loadouts', same data) list of dict, one column per loadout : loadout_1...
+FLATTEN_SCHEMA = (
+    ((), "fields", None),
+    (
+        ("playerStats",),
+        "fields",
+        "float64",
+    ),  # numbers only, floats as the API mixes both
+    (("player",), "fields", None),
+    (("player",), "loadouts", None),
+    (("player", "brMissionStats"), "fields", None),
+    (("player", "brMissionStats", "missionStatsByType"), "fields", None),
+)
+LOADOUT_KEYS = ("loadout", "loadouts")
+
+
+def _compile_schema(schema):
+    """--> list of (path, kind, dtype, keys to skip) : keys of an entry flattened by another level"""
+    levels = []
+    for path, kind, dtype in schema:
+        skipped = set()
+        for sub_path, sub_kind, _ in schema:
+            if sub_kind == "loadouts" and sub_path == path:
+                skipped.update(LOADOUT_KEYS)
+            elif len(sub_path) == len(path) + 1 and sub_path[:-1] == path:
+                skipped.add(sub_path[-1])
+        levels.append((path, kind, dtype, skipped))
+    return levels
+
+
+def _get_entry(record, path):
+    """--> dict at `path` (tuple of keys) within record, or None if missing"""
+    for key in path:
+        if not isinstance(record, dict):
+            return None
+        record = record.get(key)
+    return record if isinstance(record, dict) else None
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def flatten_records(res, n_loadouts, schema=FLATTEN_SCHEMA):
+    """Flatten match(es) API result in a single pass over its records, as columns (lists of values)
 
     Parameters
     ----------
-    df, match result previously converted as a df, with 'player' col already expanded
+    res : list(dict), match or matches API result
+    n_loadouts : int, max number of loadout columns to keep
+    schema : nested entries to flatten, see FLATTEN_SCHEMA
 
     Returns
     -------
-    Dataframe, with n columns of players loadout(s), that we will append to our main df
+    dict, {column name: values (list or np.array)}, in schema order.
+    Columns with nulls only are removed, then duplicate names (e.g. 'rank', in playerStats and player) : first kept
     """
 
-    loadout_col = "loadout" if "loadout" in df.columns.tolist() else "loadouts"
-    # when extracting, df 'player' col is already expanded, with 'loadout' accessible
-    df_loadouts = df[loadout_col].apply(pd.Series)
+    levels = _compile_schema(schema)
+    n_rows = len(res)
+    columns = {}  # {(level, name): list of values}, np.nan for missing entries
+
+    for row, record in enumerate(res):
+        for level, (path, kind, _, skipped) in enumerate(levels):
+            entry = _get_entry(record, path)
+            if entry is None:
+                continue
+
+            if kind == "loadouts":
+                loadouts = next(
+                    (entry[k] for k in LOADOUT_KEYS if entry.get(k) is not None), []
+                )
+                items = (
+                    (f"loadout_{idx+1}", loadout)
+                    for idx, loadout in enumerate(loadouts[:n_loadouts])
+                )
+            else:
+                items = (
+                    (key, value) for key, value in entry.items() if key not in skipped
+                )
+
+            for name, value in items:
+                column = columns.get((level, name))
+                if column is None:
+                    column = columns[(level, name)] = [np.nan] * n_rows
+                column[row] = value
+
+    flattened = {}
+    # stable sort : schema order, then order in which keys first appeared
+    for (level, name), values in sorted(columns.items(), key=lambda col: col[0][0]):
+        if name in flattened or all(map(_is_null, values)):
+            continue
+        dtype = levels[level][2]
+        if dtype is not None:
+            try:
+                values = np.array(values, dtype=dtype)
+            except (TypeError, ValueError):
+                pass
+        flattened[name] = values
+
+    return flattened
+
+
+class LoadoutResolver:
+    """Loadout entry (dict) --> "primary secondary" weapons names, compiled once from wz_labels.json
+
+    - a single regex strips every weapon code prefix (iw8_, s4_...)
+    - a flat {weapon code: name} table
+    - names memoized on (primary, secondary) weapons codes : a session only has a handful of loadouts
+    """
 
-    # max number of payloads to parse, as defined in conf
-    n_loadouts = CONF.get("API_OUTPUT_FORMAT")["n_loadouts"]
-    n_loadouts = (
-        n_loadouts
-        if n_loadouts <= len(df_loadouts.columns)
-        else len(df_loadouts.columns)
-    )
+    def __init__(self, prefixes, names, maxsize=1024):
+        """
+        Parameters
+        ----------
+        prefixes : list(str), weapon code prefixes to remove, LABELS["weapons"]["prefixes"]
+        names : dict, {weapon code (without prefix): name}, LABELS["weapons"]["names"]
+        maxsize : int, max (primary, secondary) combinations memoized
+        """
+        self.prefixes = (
+            re.compile("|".join(map(re.escape, prefixes))) if prefixes else None
+        )
+        self.names = dict(names)
+        self.resolve = functools.lru_cache(maxsize=maxsize)(self._resolve)
+
+    def _weapon(self, code):
+        if self.prefixes is not None:
+            code = self.prefixes.sub("", code)
+        return self.names.get(code, code)
+
+    def _resolve(self, primary, secondary):
+        """--> str, weapons names of (primary, secondary) weapon codes"""
+        return " ".join(map(self._weapon, f"{primary} {secondary}".split(" ")))
+
+    def parse(self, loadout_value):
+        """--> str, weapons names of a loadout entry ; NaN or an already parsed loadout are returned as is"""
+        if not isinstance(loadout_value, dict):
+            return np.nan if pd.isnull(loadout_value) else loadout_value
+        return self.resolve(
+            loadout_value.get("primaryWeapon")["name"],
+            loadout_value.get("secondaryWeapon")["name"],
+        )
 
-    # remove the extra loadouts ( > max loadouts to keep)
-    df_loadouts = df_loadouts.iloc[:, 0:n_loadouts]
+    def parse_column(self, col):
+        """--> categorical Series, every loadout of col parsed : one name lookup per distinct loadout"""
+        return pd.Series(
+            pd.Categorical([self.parse(value) for value in col]),
+            index=col.index,
+            name=col.name,
+        )
 
-    # rename final columns : loadout_1, loadout_2 ...
-    col_names = {idx: f"loadout_{idx+1}" for idx, col in enumerate(df_loadouts.columns)}
-    df_loadouts.rename(columns=col_names, inplace=True)
 
-    return df_loadouts
+@functools.lru_cache(maxsize=4)
+def _loadout_resolver(prefixes, names):
+    return LoadoutResolver(prefixes, dict(names))
+
+
+def get_loadout_resolver(LABELS):
+    """--> LoadoutResolver, built once per weapons labels (LABELS is reloaded at every Streamlit rerun)"""
+    weapons = LABELS["weapons"]
+    return _loadout_resolver(
+        tuple(weapons.get("prefixes") or ()), tuple(weapons["names"].items())
+    )
 
 
 def parse_loadout(loadout_value, LABELS):
@@ -70,72 +206,7 @@ def parse_loadout(loadout_value, LABELS):
     String, parsed primary and secondary weapons names
     """
 
-    def extract_weapons(loadout_value):
-        return f"{loadout_value.get('primaryWeapon')['name']} {loadout_value.get('secondaryWeapon')['name']}"
-
-    def parse_weapons(weapons, LABELS):
-        list_weapons = weapons.split(" ")
-        for PREFIX in LABELS["weapons"].get("prefixes"):
-            list_weapons = list(
-                map(lambda weapon: weapon.replace(PREFIX, ""), list_weapons)
-            )
-        list_weapons = [
-            weapon.replace(weapon, LABELS["weapons"]["names"].get(weapon, weapon))
-            for weapon in list_weapons
-        ]
-        return " ".join(list_weapons)
-
-    if pd.isnull(loadout_value):
-        return np.nan
-    else:
-        weapons = extract_weapons(loadout_value)
-        return parse_weapons(weapons, LABELS)
-
-
-def extract_missions(df):
-    """Flatten then extract (desired) mission stats from matche(s) df > player col > 'brMissionStats'
-
-    Parameters
-    ----------
-    df, match(es) result previously converted as a df, with 'player'/' col already expanded
-
-    Returns
-    -------
-    Dataframe, with desired missions KPIs as columns, that we will append to our main df
-    """
-
-    main_col = "brMissionStats"
-    sub_col = "missionStatsByType"
-    df_missions = df[main_col].apply(pd.Series)
-
-    return pd.concat(
-        [df_missions.drop([sub_col], axis=1), df_missions[sub_col].apply(pd.Series)],
-        axis=1,
-    )
-
-
-def parse_mission(mission_value):
-    """Parse a mission entry (dict), extracting 'count'
-
-    Parameters
-    ----------
-    mission_value : a dict value after we flattened a match(es) result/'player'/'brMissionStats'
-        e.g.
-        dict{
-                weaponXp:650.0},
-                xp:650,
-                count:1
-            }
-
-    Returns
-    -------
-    int, count of a given mission
-    """
-
-    if pd.isnull(mission_value):
-        return np.nan
-    else:
-        return mission_value["count"]
+    return get_loadout_resolver(LABELS).parse(loadout_value)
 
 
 def res_to_df(res, CONF):
@@ -170,45 +241,107 @@ def res_to_df(res, CONF):
     Matches : every match of a list of matches as rows, a given player stats for every match as columns/values
     """
 
-    # TODO : could try using pd.json_normalize()
-    # still requires to expand col player/loadout(s) (a list of dict) afterwards tho
-    df = pd.DataFrame(res)
+    # Single pass over the records : every nested level ('playerStats', 'player' and its loadout(s),
+    # 'brMissionStats'...) expanded at once, as declared in FLATTEN_SCHEMA
+    n_loadouts = CONF.get("API_OUTPUT_FORMAT")["n_loadouts"]
+    df = pd.DataFrame(flatten_records(res, n_loadouts), index=range(len(res)))
 
-    # cols 'playerStats' (1) and 'player' (2) can be expanded further
+    return enforce_dtypes(df, CONF)
 
-    # 1. playerStats' contains dict entries (kills, team placement...)
-    df = pd.concat(
-        [df.drop(["playerStats"], axis=1), df["playerStats"].apply(pd.Series)], axis=1
-    )
 
-    # 2. 'player' has more depth. Once expanded (also) contains 'loadout' (a) and possibly 'brMissionStats' (b)
-    df = pd.concat([df.drop(["player"], axis=1), df["player"].apply(pd.Series)], axis=1)
+def _downcast_int(col):
+    """--> Series, int32 (int64 if col values do not fit), float64 if any is missing (or not an int)"""
+    values = col.to_numpy(dtype="float64")
+    if np.isnan(values).any() or not np.array_equal(values, np.round(values)):
+        return col.astype("float64")
+    info = np.iinfo("int32")
+    if info.min <= values.min() and values.max() <= info.max:
+        return col.astype("int32")
+    return col.astype("int64")
 
-    # 2a. 'player'/'loadout' (and/or 'loadouts', same data) is a Series of list of dict
-    # We expand it to one or several cols, then parse weapons names (extract)
-    loadout_cols = [col for col in df.columns if col.startswith("loado")]
-    loadout_col = "loadout" if "loadout" in loadout_cols else "loadouts"
-    df = pd.concat([df.drop(loadout_cols, axis=1), extract_loadouts(df, CONF)], axis=1)
 
-    # 2b. 'player'/'brMissionStats', may not be returned for other game modes than BR,resu
-    #  is a Series of dict (with dict)
-    if "brMissionStats" in df.columns.tolist():
-        df = pd.concat(
-            [df.drop(["brMissionStats"], axis=1), extract_missions(df)], axis=1
-        )
+def enforce_dtypes(df, CONF):
+    """Store a flattened match(es) DataFrame with compact dtypes, as declared in conf.toml [API_OUTPUT_FORMAT]
 
-    #### final
+    - int_cols : int32 (int64 if needed), or float64 if a value is missing (e.g. gulagKills out of Battle Royale).
+      Not narrower : counters are combined arithmetically (int16 sums / products overflow silently)
+    - float_cols : float64, ratios feeding KPIs (kdRatio cumulative / rolling averages) are not downcast
+    - category_cols : repeated strings (mode, username, team...) as categoricals
 
-    # after we f lattened all the entries, columns with nulls can exist (e.g in 'brmissionstats'),
-    # also the final result may contain duplicate entries, most probably "rank" that's returned twice by the API
-    df.dropna(axis=1, how="all", inplace=True)
-    df = df.loc[
-        :, ~df.columns.duplicated()
-    ]  # gl trying to remove dupl cols in Pandas (if any col is a dict) ^_^
+    Columns not declared, or missing, are left as is. Memory saved is logged (INFO)
+    """
 
+    conf_format = CONF.get("API_OUTPUT_FORMAT")
+    report = logger.isEnabledFor(logging.INFO)
+    if report:
+        bytes_before = df.memory_usage(deep=True).sum()
+
+    for col in conf_format.get("int_cols", []):
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = _downcast_int(df[col])
+    for col in conf_format.get("float_cols", []):
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype("float64")
+    for col in conf_format.get("category_cols", []):
+        if col in df.columns and df[col].dtype == object:
+            df[col] = df[col].astype("category")
+
+    if report:
+        bytes_after = df.memory_usage(deep=True).sum()
+        logger.info(
+            "%s rows : %d bytes -> %d bytes (%d saved)",
+            len(df),
+            bytes_before,
+            bytes_after,
+            bytes_before - bytes_after,
+        )
     return df
 
 
+def to_local_datetime(ts):
+    """--> Series of datetime64, epoch timestamps (seconds) as naive local datetimes
+
+    datetime.fromtimestamp() once per distinct timestamp : players of a match share the same ones
+    """
+    return pd.to_datetime(map_unique(ts, datetime.fromtimestamp))
+
+
+def to_clock(seconds, with_seconds=True):
+    """--> Series of str, a duration in seconds as 'MM:SS' (or 'MM'), minutes within the hour as strftime() would
+
+    Integer arithmetic on the whole column ; NaN stays NaN
+    """
+    valid = seconds.notna()
+    total = np.floor(seconds[valid].astype("float64")).astype("int64")
+    clock = (total % 3600 // 60).astype(str).str.zfill(2)
+    if with_seconds:
+        clock = clock + ":" + (total % 60).astype(str).str.zfill(2)
+    return clock.reindex(seconds.index)
+
+
+def modes_mapping(LABELS):
+    """--> dict, {API mode: parsed mode name}, every wz_labels.json mode group combined into one mapping
+
+    Groups are applied in order, a group may rename what a previous one returned
+    """
+    mapping = {}
+    for group in LABELS.get("modes").values():
+        for mode, name in mapping.items():
+            mapping[mode] = group.get(name, name)
+        for mode, name in group.items():
+            mapping.setdefault(mode, name)
+    return mapping
+
+
+def map_unique(col, func):
+    """--> Series, func(value) for every value of col, computed once per distinct value (NaN stays NaN)"""
+    codes, uniques = pd.factorize(col)
+    # missing values (code -1) pick the trailing NaN
+    mapped = np.array([func(value) for value in uniques] + [np.nan], dtype=object)
+    mapped_col = pd.Series(mapped[codes], index=col.index, name=col.name)
+    return mapped_col.astype("category") if col.dtype == "category" else mapped_col
+
+
 def format_df(df, CONF, LABELS):
     """Add a first layer of standadization (as : properly formatted) to our matches/match DataFrame
 
@@ -231,36 +364,27 @@ def format_df(df, CONF, LABELS):
 
     # Make timestamps (start/end times of a match) and durations/length readable
     for ts_col in CONF["API_OUTPUT_FORMAT"]["ts_cols"]:
-        df[ts_col] = df[ts_col].apply(lambda x: datetime.fromtimestamp(x))
-    df["duration"] = (
-        df["duration"]
-        .apply(lambda x: x / 1000)
-        .apply(lambda x: pd.to_datetime(x, unit="s").strftime("%M"))
-    )  # API duration is in seconds x1000
-    df["timePlayed"] = df["timePlayed"].apply(
-        lambda x: pd.to_datetime(x, unit="s").strftime("%M:%S")
-    )  # API timePlayed is in seconds
+        df[ts_col] = to_local_datetime(df[ts_col])
+    # API duration is in seconds x1000
+    df["duration"] = to_clock(df["duration"] // 1000, with_seconds=False)
+    # API timePlayed is in seconds
+    df["timePlayed"] = to_clock(df["timePlayed"])
 
     # Loadouts/weapons : extract then parse weapons from loadout(s) cols
     loadout_cols = [col for col in df.columns if col.startswith("loadout_")]
-    if loadout_cols:
-        for col in loadout_cols:
-            df[col] = df[col].apply(
-                lambda x: parse_loadout(x, LABELS) if not str(x) == "nan" else np.nan
-            )
+    resolver = get_loadout_resolver(LABELS)
+    for col in loadout_cols:
+        df[col] = resolver.parse_column(df[col])
 
     # Missions types : extract count
     for mission_col in LABELS.get("missions")["types"]:
         if mission_col in df.columns.tolist():
-            df[mission_col] = (
-                df[mission_col]
-                .apply(lambda x: parse_mission(x) if not str(x) == "nan" else np.nan)
-                .astype("Int64")
-            )
+            df[mission_col] = df[mission_col].str.get("count").astype("Int64")
 
     # parse game modes (either battle royale : duos..., or others plunder, rebirth island...)
-    for mode in list(LABELS.get("modes").keys()):
-        df = df.replace({"mode": LABELS.get("modes")[mode]})
+    # once per distinct mode, not per row
+    mapping = modes_mapping(LABELS)
+    df["mode"] = map_unique(df["mode"], lambda mode: mapping.get(mode, mode))
 
     return df
 
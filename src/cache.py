@@ -0,0 +1,414 @@
+import asyncio
+import functools
+import inspect
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+from src.resilience import CircuitOpenError, is_unavailable
+
+"""
+Inside
+-----
+Persistent (local disk) cache for COD API responses
+
+- Keys are built from the semantic arguments of a call only : platform, username, matchId, endTimestamp...
+  never from the httpx client or a concurrency primitive, so entries survive Streamlit reruns and process restarts
+- Responses are stored as json in a single SQLite file, path and per-endpoint expiration set in conf.toml
+- Decorator cached_response() plugs the cache on EnhancedApi methods
+- HistoryStore : known matches history per player, so a refresh only requests what's new
+- KpiStore : kd history KPIs state per player & mode (see kd_history.KpiEngine), so a refresh only computes what's new
+- LobbyKdStore : predicted lobby kd per match & model version, shared by every player of a lobby
+- Single-flight : concurrent identical calls (e.g. squad-mates opening the app after the same game)
+  share the one in-flight request, see SingleFlight & decorator single_flight()
+"""
+
+
+class SqliteStore:
+    """Base of our local stores : one SQLite file, its connection shared (behind a lock) by all threads
+
+    Streamlit runs every session in its own thread, the service loop runs in another one
+    """
+
+    schema = ""
+
+    def __init__(self, path):
+        """path : str or Path, SQLite file, created with its parent folder(s) if needed"""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock:
+            self._conn.executescript(self.schema)
+            self._conn.commit()
+
+    def _execute(self, query, params=(), many=False):
+        """--> list of rows, run a query (or executemany if many=True) and commit"""
+        with self._lock:
+            if many:
+                cursor = self._conn.executemany(query, params)
+            else:
+                cursor = self._conn.execute(query, params)
+            rows = cursor.fetchall()
+            self._conn.commit()
+        return rows
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache(SqliteStore):
+    """SQLite-backed store of API responses, keyed on (endpoint, semantic arguments)"""
+
+    schema = """CREATE TABLE IF NOT EXISTS responses (
+        endpoint TEXT NOT NULL,
+        key TEXT NOT NULL,
+        stored_at REAL NOT NULL,
+        payload TEXT NOT NULL,
+        PRIMARY KEY (endpoint, key)
+    )"""
+
+    def __init__(self, path, ttl=None):
+        """
+        Parameters
+        ----------
+        path : str or Path, SQLite file, created with its parent folder(s) if needed
+        ttl : dict, {endpoint: max age in seconds}. Endpoints not listed never expire,
+            e.g. a match (or an already played page of history) will not change anymore
+        """
+        super().__init__(path)
+        self.ttl = ttl or {}
+
+    @classmethod
+    def from_conf(cls, CONF):
+        """--> ResponseCache, or None if cache is disabled in conf.toml [API_CACHE]"""
+        conf_cache = CONF.get("API_CACHE", {})
+        if not conf_cache.get("enabled", False):
+            return None
+        return cls(conf_cache["path"], ttl=conf_cache.get("ttl"))
+
+    @staticmethod
+    def make_key(*args):
+        """--> str, stable key from semantic arguments (matchId 123 and "123" are the same match)"""
+        return json.dumps([str(arg) for arg in args])
+
+    def get(self, endpoint, key, max_age=None):
+        """--> stored response, or None if missing or older than max_age (seconds)"""
+        rows = self._execute(
+            "SELECT stored_at, payload FROM responses WHERE endpoint = ? AND key = ?",
+            (endpoint, key),
+        )
+        if not rows:
+            return None
+        stored_at, payload = rows[0]
+        if max_age is not None and time.time() - stored_at > max_age:
+            return None
+        return json.loads(payload)
+
+    def set(self, endpoint, key, response):
+        """Store (or replace) a response"""
+        self._execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+            (endpoint, key, time.time(), json.dumps(response)),
+        )
+
+
+class HistoryStore(SqliteStore):
+    """Known matches history (recent matches entries) per player, for incremental history sync"""
+
+    schema = """CREATE TABLE IF NOT EXISTS history (
+        platform TEXT NOT NULL,
+        username TEXT NOT NULL,
+        matchID TEXT NOT NULL,
+        utcStartSeconds INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        PRIMARY KEY (platform, username, matchID)
+    )"""
+
+    @classmethod
+    def from_conf(cls, CONF):
+        """--> HistoryStore (same SQLite file as the API cache), or None if disabled in conf.toml [API_CACHE]"""
+        conf_cache = CONF.get("API_CACHE", {})
+        if not conf_cache.get("enabled", False) or not conf_cache.get("history_sync"):
+            return None
+        return cls(conf_cache["path"])
+
+    def known_ids(self, platform, username, match_ids):
+        """--> set(str), match ids (among match_ids) already stored for this player"""
+        match_ids = [str(match_id) for match_id in match_ids]
+        if not match_ids:
+            return set()
+        rows = self._execute(
+            f"""SELECT matchID FROM history WHERE platform = ? AND username = ?
+            AND matchID IN ({", ".join("?" * len(match_ids))})""",
+            (platform, username, *match_ids),
+        )
+        return {row[0] for row in rows}
+
+    def add(self, platform, username, matches):
+        """Store (or replace) recent matches entries of a player"""
+        self._execute(
+            "INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    platform,
+                    username,
+                    str(match["matchID"]),
+                    match["utcStartSeconds"],
+                    json.dumps(match),
+                )
+                for match in matches
+            ],
+            many=True,
+        )
+
+    def latest(self, platform, username, n):
+        """--> list(dict), n most recent matches of a player, most recent first (as returned by the API)"""
+        rows = self._execute(
+            """SELECT payload FROM history WHERE platform = ? AND username = ?
+            ORDER BY utcStartSeconds DESC LIMIT ?""",
+            (platform, username, n),
+        )
+        return [json.loads(row[0]) for row in rows]
+
+
+class KpiStore(SqliteStore):
+    """kd history KPIs per player & mode : online engine state, and KPIs of every match it went through"""
+
+    schema = """CREATE TABLE IF NOT EXISTS kpi_state (
+        platform TEXT NOT NULL,
+        username TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        PRIMARY KEY (platform, username, mode)
+    );
+    CREATE TABLE IF NOT EXISTS kpi_rows (
+        platform TEXT NOT NULL,
+        username TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        matchID TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        PRIMARY KEY (platform, username, mode, matchID)
+    )"""
+
+    @classmethod
+    def from_conf(cls, CONF):
+        """--> KpiStore (same SQLite file as the API cache), or None if disabled in conf.toml [API_CACHE]"""
+        conf_cache = CONF.get("API_CACHE", {})
+        if not conf_cache.get("enabled", False) or not conf_cache.get("kpi_sync"):
+            return None
+        return cls(conf_cache["path"])
+
+    def get_state(self, platform, username, mode):
+        """--> dict, engine state, or None if unknown"""
+        rows = self._execute(
+            "SELECT payload FROM kpi_state WHERE platform = ? AND username = ? AND mode = ?",
+            (platform, username, mode),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_rows(self, platform, username, mode, match_ids):
+        """--> dict, {matchID: KPIs} of match_ids already computed"""
+        match_ids = [str(match_id) for match_id in match_ids]
+        if not match_ids:
+            return {}
+        rows = self._execute(
+            f"""SELECT matchID, payload FROM kpi_rows WHERE platform = ? AND username = ? AND mode = ?
+            AND matchID IN ({", ".join("?" * len(match_ids))})""",
+            (platform, username, mode, *match_ids),
+        )
+        return {match_id: json.loads(payload) for match_id, payload in rows}
+
+    def save(self, platform, username, mode, state, rows, replace=False):
+        """Store engine state and new matches KPIs ({matchID: KPIs}) ; replace : forget previous KPIs first"""
+        with self._lock:
+            if replace:
+                self._conn.execute(
+                    "DELETE FROM kpi_rows WHERE platform = ? AND username = ? AND mode = ?",
+                    (platform, username, mode),
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kpi_state VALUES (?, ?, ?, ?)",
+                (platform, username, mode, json.dumps(state)),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO kpi_rows VALUES (?, ?, ?, ?, ?)",
+                [
+                    (platform, username, mode, str(match_id), json.dumps(kpis))
+                    for match_id, kpis in rows.items()
+                ],
+            )
+            # state and rows saved at once
+            self._conn.commit()
+
+
+class LobbyKdStore(SqliteStore):
+    """Predicted lobby kd (src/predict.py) per match and model version : it depends on the match only"""
+
+    schema = """CREATE TABLE IF NOT EXISTS lobby_kd (
+        matchID TEXT NOT NULL,
+        model TEXT NOT NULL,
+        utcEndSeconds INTEGER NOT NULL,
+        lobbyKd REAL NOT NULL,
+        PRIMARY KEY (matchID, model)
+    )"""
+
+    @classmethod
+    def from_conf(cls, CONF):
+        """--> LobbyKdStore (same SQLite file as the API cache), or None if disabled in conf.toml [API_CACHE]"""
+        conf_cache = CONF.get("API_CACHE", {})
+        if not conf_cache.get("enabled", False) or not conf_cache.get("lobby_kd_sync"):
+            return None
+        return cls(conf_cache["path"])
+
+    def get(self, match_ids, model):
+        """--> dict, {matchID: (utcEndSeconds, lobbyKd)} of match_ids already predicted by this model version"""
+        match_ids = [str(match_id) for match_id in match_ids]
+        if not match_ids:
+            return {}
+        rows = self._execute(
+            f"""SELECT matchID, utcEndSeconds, lobbyKd FROM lobby_kd WHERE model = ?
+            AND matchID IN ({", ".join("?" * len(match_ids))})""",
+            (model, *match_ids),
+        )
+        return {match_id: (end, lobby_kd) for match_id, end, lobby_kd in rows}
+
+    def add(self, model, predictions):
+        """Store (or replace) predictions of a model version, {matchID: (utcEndSeconds, lobbyKd)}"""
+        self._execute(
+            "INSERT OR REPLACE INTO lobby_kd VALUES (?, ?, ?, ?)",
+            [
+                (str(match_id), model, end, lobby_kd)
+                for match_id, (end, lobby_kd) in predictions.items()
+            ],
+            many=True,
+        )
+
+
+def _bind_key(signature, keys, self, args, kwargs):
+    """--> tuple(str), values of `keys` arguments for this method call"""
+    arguments = signature.bind(self, *args, **kwargs).arguments
+    return tuple(str(arguments[k]) for k in keys)
+
+
+def is_error_payload(response):
+    """--> bool, COD API answered with an error (key "message"), e.g. profile not found or private"""
+    return isinstance(response, dict) and "message" in response
+
+
+def cached_response(endpoint, keys, projection=None):
+    """Decorator for EnhancedApi async methods : serve the response from self.cache if available
+    While COD API is down (e.g. circuit breaker open), a stored response is served even if expired
+
+    Parameters
+    ----------
+    endpoint : str, cache namespace, also used to look up its expiration in cache.ttl
+    keys : tuple(str), names of the decorated method arguments the cache key is built from
+    projection : str, optional, name of the EnhancedApi attribute holding the src.projection.Projection
+        applied to responses : its fingerprint is part of the key, so changing the projected fields
+        does not serve responses stored with other fields
+    """
+
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            cache = getattr(self, "cache", None)
+            if cache is None:
+                return await method(self, *args, **kwargs)
+
+            key_args = _bind_key(signature, keys, self, args, kwargs)
+            applied = getattr(self, projection, None) if projection else None
+            if applied is not None:
+                key_args += (applied.fingerprint,)
+            key = cache.make_key(*key_args)
+            response = cache.get(endpoint, key, max_age=cache.ttl.get(endpoint))
+            if response is not None:
+                return response
+
+            try:
+                response = await method(self, *args, **kwargs)
+            except (CircuitOpenError, httpx.HTTPError) as exc:
+                # COD API is down : an expired response is better than none
+                response = cache.get(endpoint, key)
+                if response is None or not is_unavailable(exc):
+                    raise
+                return response
+            # do not store a failed / empty call, nor an error payload (e.g. private profile, that can be fixed)
+            if response is not None and not is_error_payload(response):
+                cache.set(endpoint, key, response)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+class SingleFlight:
+    """Registry of in-flight calls : a call whose key is already in flight awaits the same future
+
+    The call is cancelled once every caller awaiting it was cancelled (e.g. a stream consumer stopped)
+    Must be used from a single event loop (the ApiService loop)
+    """
+
+    def __init__(self):
+        self._calls = {}  # key: [future, count of callers awaiting it]
+        self.shared = 0  # count of calls served by another caller's request
+
+    async def do(self, key, coro_function):
+        """--> result of coro_function(), executed once for all concurrent callers of `key`"""
+        call = self._calls.get(key)
+        if call is None:
+            call = [asyncio.ensure_future(coro_function()), 0]
+            self._calls[key] = call
+            call[0].add_done_callback(
+                lambda _: self._calls.pop(key) if self._calls.get(key) is call else None
+            )
+        else:
+            self.shared += 1
+        future = call[0]
+        call[1] += 1
+        try:
+            # a caller being cancelled (e.g. Streamlit rerun) must not cancel the others' shared call
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # ... but once nobody awaits it anymore, the request is not needed
+            if call[1] == 1:
+                future.cancel()
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            raise
+        finally:
+            call[1] -= 1
+
+
+def single_flight(endpoint, keys):
+    """Decorator for EnhancedApi async methods : deduplicate concurrent calls through self.flights
+
+    Parameters
+    ----------
+    endpoint : str, namespace of the key
+    keys : tuple(str), names of the decorated method arguments identifying a call
+    """
+
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            flights = getattr(self, "flights", None)
+            if flights is None:
+                return await method(self, *args, **kwargs)
+
+            key = (endpoint,) + _bind_key(signature, keys, self, args, kwargs)
+            return await flights.do(key, lambda: method(self, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
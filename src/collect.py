@@ -0,0 +1,187 @@
+import asyncio
+import pickle
+
+import httpx
+
+from src import utils
+from src.resilience import CircuitOpenError, is_unavailable
+from src.sessions_history import SessionIndex
+
+"""
+Inside
+------
+The data a page needs from COD API, collected as a small async task graph instead of one call after another
+
+    profile ─────────────────────────────────────────────────►
+    recent matches, 1st page ──┬─► recent matches, next pages (history) ──┐
+                               └─► last session ids ─► last session matches (streamed) ─► missing ones
+                                                                                         (if any, once history is complete)
+
+- Profile and history paging run concurrently
+- Last session matches are requested as soon as the first page of history reveals the latest session ids
+  (a session can span over more than a page : any missing id is collected once history is complete)
+- Sessions (SessionIndex) are indexed page after page as history arrives, then shared with the page
+- Page latency tends to the longest single chain instead of the sum of all calls
+- If COD API is down (circuit breaker open, server errors) and nothing is cached, a chain falls back to offline data
+  (last session : only along offline history, else no match, live and offline sessions are not mixed). If history
+  falls back after a live first page, sessions are indexed again from the offline history only
+"""
+
+# Previously saved API responses, used in offline mode or if COD API is down
+OFFLINE_DATA = {
+    "profile": "data/sample_profile.pkl",
+    "recent_matches": "data/sample_recent_matches.pkl",
+    "last_session": "data/sample_last_session.pkl",
+}
+
+
+def load_offline(name):
+    """--> previously saved API response : "profile", "recent_matches" or "last_session" """
+    with open(OFFLINE_DATA[name], "rb") as f:
+        return pickle.load(f)
+
+
+class PageData:
+    """Start every API call of a page at once (on an ApiService), await their results where needed
+
+    Usage, in our async Home.main():
+        page_data = PageData(service, platform, username, max_calls=5)
+        profile = await page_data.profile
+        recent_matches = await page_data.history
+        last_ids = page_data.sessions.last_session_ids()
+        async for match in page_data.last_session_matches(): ...
+    """
+
+    def __init__(self, service, platform, username, max_calls=5, sessions=None):
+        """sessions : SessionIndex to fill with the history, e.g. SessionIndex.from_conf(CONF)"""
+        self.service = service
+        self.platform = platform
+        self.username = username
+        self.max_calls = max_calls
+        # complete once history is
+        self.sessions = sessions if sessions is not None else SessionIndex()
+        # True if any chain had to fall back to offline data
+        self.degraded = False
+        # True if history is offline data (then so are the sessions ids)
+        self.offline_history = False
+
+        self.profile = asyncio.ensure_future(self._collect_profile())
+        self.first_page = asyncio.ensure_future(self._collect_first_page())
+        self.history = asyncio.ensure_future(self._collect_history())
+        self._last_session = asyncio.Queue()
+        self._last_session_task = asyncio.ensure_future(self._collect_last_session())
+
+    def _offline(self, name):
+        self.degraded = True
+        return load_offline(name)
+
+    async def _collect_profile(self):
+        try:
+            return await self.service.GetProfileCached(self.platform, self.username)
+        except (CircuitOpenError, httpx.HTTPError) as exc:
+            if not is_unavailable(exc):
+                raise
+            return self._offline("profile")
+
+    async def _collect_first_page(self):
+        """--> list(dict), 20 most recent matches, or None if COD API is down"""
+        try:
+            return await self.service.GetRecentMatchesNotCached(
+                self.platform, self.username
+            )
+        except (CircuitOpenError, httpx.HTTPError) as exc:
+            if not is_unavailable(exc):
+                raise
+            return None
+
+    async def _collect_history(self):
+        """--> list(dict), max_calls * 20 recent matches, first page shared with the last session chain"""
+        first_page = await self.first_page
+        try:
+            history = await self.service.GetRecentMatchesWithDateLoop(
+                self.platform,
+                self.username,
+                max_calls=self.max_calls,
+                first_page=first_page,
+            )
+        except (CircuitOpenError, httpx.HTTPError) as exc:
+            if not is_unavailable(exc):
+                raise
+            history = self._offline("recent_matches")
+            self.offline_history = True
+            # live first page matches may be indexed already : sessions of the offline history only
+            self.sessions.clear()
+        # first page matches are already indexed, if any : next pages only are compared
+        self.sessions.update(history)
+        return history
+
+    async def _stream_matches(self, match_ids):
+        """Stream matches to the last session queue --> int, count of matches collected"""
+        n_matches = 0
+        async for match in self.service.stream(
+            "GetMatchListStream", self.platform, match_ids
+        ):
+            await self._last_session.put(match)
+            n_matches += 1
+        return n_matches
+
+    async def _put_offline_last_session(self):
+        """Offline last session matches to the queue (live matches already there match no offline session id)"""
+        for match in utils.split_matches(self._offline("last_session")):
+            await self._last_session.put(match)
+
+    async def _collect_last_session(self):
+        """Stream last session matches to a queue, ended by None"""
+        n_matches = 0
+        try:
+            first_page = await self.first_page
+            if not self.offline_history:
+                self.sessions.update(first_page or [])
+            try:
+                match_ids = self.sessions.last_session_ids()
+            except IndexError:
+                # first page without Battle Royale / Resurgence match, wait for the whole history
+                match_ids = []
+            n_matches += await self._stream_matches(match_ids)
+
+            # last session may have started before the first page : collect ids known from whole history
+            await self.history
+            if self.offline_history:
+                # history fell back to offline data (next pages failed) : so does the last session
+                await self._put_offline_last_session()
+                return
+            history_ids = self.sessions.last_session_ids()
+            missing_ids = [id_ for id_ in history_ids if id_ not in match_ids]
+            if missing_ids:
+                n_matches += await self._stream_matches(missing_ids)
+
+        except (CircuitOpenError, httpx.HTTPError) as exc:
+            if not is_unavailable(exc):
+                raise
+            # COD API went down : keep the matches already collected, if any
+            self.degraded = True
+            # offline last session only goes with offline history : live session ids match none of its matches
+            await asyncio.wait([self.history])
+            if self.offline_history:
+                await self._put_offline_last_session()
+        finally:
+            await self._last_session.put(None)
+
+    async def last_session_matches(self):
+        """Async iterator, every last session match (list of players stats) as soon as collected"""
+        while True:
+            match = await self._last_session.get()
+            if match is None:
+                break
+            yield match
+        # surface errors of the last session chain, if any
+        await self._last_session_task
+
+    def cancel(self):
+        for task in (
+            self.profile,
+            self.first_page,
+            self.history,
+            self._last_session_task,
+        ):
+            task.cancel()
@@ -1,25 +1,41 @@
 import itertools
 import asyncio
-from typing import AsyncContextManager
 
 import streamlit as st
-from async_lru import alru_cache
 import backoff
 import httpx
 
 from wzlight import Api
 
+from src.cache import SingleFlight, cached_response, single_flight
+from src.limits import AdaptiveLimiter, RateLimiter
+from src.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    is_permanent,
+    is_unavailable,
+    mark_sent,
+    retry_after_expo,
+)
+
 """
 Inside
 -----
 wzlight client enhancements
 
 - New class EnhancedApi that inherits wzlight Api Cls variables and methods
-- Add async-compatible caching with async_lru lib to avoid consuming too many calls
-- Add backoff with backoff lib
-- Basic rate/concurrency limits e.g. getting data of list[matches]) w/ asyncio.Semaphore
-- New method to loop over GetRecentMatches (history)
-- New method to requests detailed several match stats (GetMatch) concurrently
+- Add a persistent (SQLite) cache, keyed on platform/username/matchId/timestamp only, to avoid consuming too many calls
+- Add backoff with backoff lib : waits for the server Retry-After hint if any, no retry on 4xx client errors
+- Circuit breaker shared by every request : during an outage calls fail fast, cached/offline data is served
+- Failed requests (non 2xx status) raise httpx.HTTPStatusError, so backoff & limits can react to them
+- Adaptive (AIMD) concurrency limit when getting data of list[matches], backs off on 429/5xx & Retry-After
+- Rate limit (token buckets per endpoint) shared by every request of the process, see src/limits.py
+- Optional hedged requests on match details, to cut the latency tail, see src/resilience.py
+- Optional projection of match details : only the fields the app reads are kept (and cached), see src/projection.py
+- Single-flight : identical calls already in flight (same platform/matchId, platform/username/endTimestamp...)
+  are awaited, not sent twice
+- New method to loop over GetRecentMatches (history), or sync it incrementally with a local store
+- New method to requests detailed several match stats (GetMatch) concurrently, or streamed as they arrive
 
 """
 
@@ -27,50 +43,155 @@ wzlight client enhancements
 class EnhancedApi(Api):
     """Inherits wzlight Api Cls, add or enhance default methods"""
 
-    def __init__(self, sso):
+    def __init__(
+        self,
+        sso,
+        cache=None,
+        match_limiter=None,
+        rate_limiter=None,
+        history=None,
+        hedging=None,
+        breaker=None,
+        match_projection=None,
+    ):
+        """
+        cache : src.cache.ResponseCache instance, or None to always call the API
+        match_limiter : src.limits.AdaptiveLimiter shared by every GetMatch call, default settings if None
+        rate_limiter : src.limits.RateLimiter every request draws from, no rate limit if None
+        history : src.cache.HistoryStore, known matches per player for incremental sync, or None
+        hedging : src.resilience.HedgePolicy for GetMatch calls, or None (no hedged requests)
+        breaker : src.resilience.CircuitBreaker shared by every request, default settings if None
+        match_projection : src.projection.Projection, fields of GetMatch results to keep, or None (all)
+        """
         super().__init__(sso)
+        self.cache = cache
+        self.match_limiter = match_limiter or AdaptiveLimiter()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.flights = SingleFlight()
+        self.history = history
+        self.hedging = hedging
+        self.breaker = breaker or CircuitBreaker()
+        self.match_projection = match_projection
+
+    @staticmethod
+    def _endpoint(url):
+        """--> str, rate limit budget a wzlight url belongs to : "profile", "match" or "matches" """
+        if "/fullMatch/" in url:
+            return "match"
+        if "/profile/" in url:
+            return "profile"
+        return "matches"
+
+    async def _fetch(self, httpxClient, url):
+        """Override Api._fetch :
+        - every request (whatever the Api method) goes through the circuit breaker (CircuitOpenError if open)
+          then waits for its endpoint rate limit token
+        - raise httpx.HTTPStatusError on a non 2xx status (wzlight prints the error then returns None),
+          so backoff / limits see the status & headers
+        """
+
+        if not self.loggedIn:
+            return "You must initialize the Api with an SSO token"
+
+        async with self.breaker:
+            await self.rate_limiter.acquire(self._endpoint(url))
+            # hedged requests are timed from here
+            mark_sent()
+            response = await httpxClient.get(url, headers=self.headers)
+            response.raise_for_status()
+        return response.json()
 
-    @alru_cache(maxsize=8)
-    @backoff.on_exception(backoff.expo, httpx.HTTPError, max_time=10, max_tries=2)
+    @single_flight("profile", keys=("platform", "username"))
+    @cached_response("profile", keys=("platform", "username"))
+    @backoff.on_exception(
+        retry_after_expo,
+        httpx.HTTPError,
+        giveup=is_permanent,
+        jitter=None,
+        max_time=10,
+        max_tries=2,
+    )
     async def GetProfileCached(self, httpxClient, platform, username):
         """Tweak Api.GetProfile adding caching, backoff"""
 
         return await self.GetProfile(httpxClient, platform, username)
 
-    @alru_cache(maxsize=128)
-    @backoff.on_exception(backoff.expo, httpx.HTTPError, max_time=25, max_tries=5)
-    async def GetMatchSafe(
-        self,
-        httpxClient,
-        platform,
-        matchId: int,
-        sema: AsyncContextManager,
-    ):
-        """Tweak Api.GetMatch adding caching, backoff, async.Semaphore limit object"""
+    @single_flight("match", keys=("platform", "matchId"))
+    @cached_response(
+        "match", keys=("platform", "matchId"), projection="match_projection"
+    )
+    @backoff.on_exception(
+        retry_after_expo,
+        httpx.HTTPError,
+        giveup=is_permanent,
+        jitter=None,
+        max_time=25,
+        max_tries=5,
+    )
+    async def GetMatchSafe(self, httpxClient, platform, matchId: int):
+        """Tweak Api.GetMatch adding caching, backoff, adaptive concurrency limit, hedging (optional),
+        projection (optional) : only the fields the app reads are kept, before caching
+        """
+
+        async def get_match():
+            async with self.match_limiter:
+                return await self.GetMatch(httpxClient, platform, matchId)
+
+        if self.hedging is None:
+            match = await get_match()
+        else:
+            match = await self.hedging.run(get_match)
 
-        async with sema:
-            r = await self.GetMatch(httpxClient, platform, matchId)
-            await asyncio.sleep(0.5)
-            if sema.locked():
-                print("Concurrency limit reached, waiting ...")
-                await asyncio.sleep(0.5)
-            return r
+        if self.match_projection is None:
+            return match
+        return self.match_projection.apply(match)
 
     async def GetMatchList(self, httpxClient, platform, matchIds: list[int]):
         """New Api method : run GetMatchSafe (--> Api.GetMatch) async/"concurrently",
-        with a limit,  given a list of MatchIds.
+        with an adaptive limit (self.match_limiter), given a list of MatchIds.
+        Duplicate ids (or ids already requested by another session) are fetched only once, see single_flight
         """
 
-        sema = asyncio.Semaphore(2)
         tasks = []
         for matchId in matchIds:
-            tasks.append(self.GetMatchSafe(httpxClient, platform, matchId, sema))
+            tasks.append(self.GetMatchSafe(httpxClient, platform, matchId))
 
         results = await asyncio.gather(*tasks, return_exceptions=True)
+        # every request went to its end (no sibling cancelled) : surface the first error, if any
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
         return list(itertools.chain(*results))
 
-    @alru_cache(maxsize=128)
-    @backoff.on_exception(backoff.expo, httpx.HTTPError, max_time=20, max_tries=3)
+    async def GetMatchListStream(self, httpxClient, platform, matchIds: list[int]):
+        """New Api method : streaming version of GetMatchList, an async iterator.
+        Yield every match (players stats, list[dict]) as soon as it is collected, fastest first,
+        so the app can render the first match without waiting for the slowest one.
+        Requests still pending are cancelled if the consumer stops iterating, except those another caller
+        awaits too (same match requested by another session, see single_flight)
+        """
+
+        tasks = [
+            asyncio.ensure_future(self.GetMatchSafe(httpxClient, platform, matchId))
+            for matchId in matchIds
+        ]
+        try:
+            for next_match in asyncio.as_completed(tasks):
+                yield await next_match
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @single_flight("matches", keys=("platform", "username", "endTimestamp"))
+    @cached_response("matches", keys=("platform", "username", "endTimestamp"))
+    @backoff.on_exception(
+        retry_after_expo,
+        httpx.HTTPError,
+        giveup=is_permanent,
+        jitter=None,
+        max_time=20,
+        max_tries=3,
+    )
     async def GetRecentMatchesWithDateCached(
         self, httpxClient, platform, username, endTimestamp
     ):
@@ -80,10 +201,17 @@ class EnhancedApi(Api):
             httpxClient, platform, username, endTimestamp
         )
 
-    @backoff.on_exception(backoff.expo, httpx.HTTPError, max_time=20, max_tries=3)
+    @single_flight("recent_matches", keys=("platform", "username"))
+    @backoff.on_exception(
+        retry_after_expo,
+        httpx.HTTPError,
+        giveup=is_permanent,
+        jitter=None,
+        max_time=20,
+        max_tries=3,
+    )
     async def GetRecentMatchesNotCached(self, httpxClient, platform, username):
         """Tweak Api.GetRecentMatches adding backoff (and no cache!)"""
-        await asyncio.sleep(0.5)
         return await self.GetRecentMatches(httpxClient, platform, username)
 
     async def GetRecentMatchesWithDateLoop(
@@ -92,17 +220,27 @@ class EnhancedApi(Api):
         """New Api method :
         After a first --not cached, call to Recent Matches (history),
         loop over GetRecentMatchesWithDateCached, so we get n * 20 recent matches
+
+        If a history store is set (and kwarg incremental is not False), sync incrementally instead,
+        see GetRecentMatchesSync.
+        kwarg first_page : Recent Matches (1st page) result if the caller already requested it
         """
 
         max_calls = kwargs.get("max_calls", 4)
+        if self.history is not None and kwargs.get("incremental", True):
+            return await self.GetRecentMatchesSync(
+                httpxClient, platform, username, **kwargs
+            )
+
         ncalls = 0
 
         all_batchs = []
 
         # A mandatory --not cached, 1st call because we want an updated history""
-        updated_history = await self.GetRecentMatchesNotCached(
-            httpxClient, platform, username
-        )
+        # (unless already requested by the caller, see kwarg first_page)
+        updated_history = kwargs.get(
+            "first_page"
+        ) or await self.GetRecentMatchesNotCached(httpxClient, platform, username)
         endTimestamp = updated_history[-1]["utcStartSeconds"] * 1000
         all_batchs.append(updated_history)
         ncalls += 1
@@ -115,6 +253,52 @@ class EnhancedApi(Api):
             endTimestamp = batch_20[-1]["utcStartSeconds"] * 1000
             all_batchs.append(batch_20)
             ncalls += 1
-            await asyncio.sleep(0.5)
 
         return list(itertools.chain(*all_batchs))
+
+    async def GetRecentMatchesSync(self, httpxClient, platform, username, **kwargs):
+        """New Api method : incremental history sync, using the matches already known in self.history
+
+        Request the newest page of Recent Matches (history), then older pages only until a page overlaps
+        matches we already have (or max_calls is reached). The usual refresh costs a single call.
+
+        Returns
+        -------
+        list(dict), the max_calls * 20 most recent matches, same format as GetRecentMatchesWithDateLoop
+        """
+
+        max_calls = kwargs.get("max_calls", 4)
+        ncalls = 0
+
+        try:
+            batch_20 = kwargs.get("first_page") or await self.GetRecentMatchesNotCached(
+                httpxClient, platform, username
+            )
+        except (CircuitOpenError, httpx.HTTPError) as exc:
+            # COD API is down : serve what we already know, if anything
+            known_history = self.history.latest(platform, username, max_calls * 20)
+            if not known_history or not is_unavailable(exc):
+                raise
+            return known_history
+        ncalls += 1
+
+        while batch_20:
+            batch_ids = [match["matchID"] for match in batch_20]
+            overlaps = self.history.known_ids(platform, username, batch_ids)
+            self.history.add(platform, username, batch_20)
+            if overlaps or ncalls >= max_calls:
+                break
+
+            endTimestamp = batch_20[-1]["utcStartSeconds"] * 1000
+            try:
+                batch_20 = await self.GetRecentMatchesWithDateCached(
+                    httpxClient, platform, username, endTimestamp
+                )
+            except (CircuitOpenError, httpx.HTTPError) as exc:
+                # COD API went down : serve what we know, pages synced so far included
+                if not is_unavailable(exc):
+                    raise
+                break
+            ncalls += 1
+
+        return self.history.latest(platform, username, max_calls * 20)
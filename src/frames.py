@@ -0,0 +1,372 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src import api_format, session_details
+
+try:
+    import polars as pl  # optional dependency, "polars" frame backend
+
+    POLARS_AVAILABLE = True
+except ImportError:
+    POLARS_AVAILABLE = False
+
+"""
+Inside
+-----
+Pluggable frame backend : res_to_df -> format_df -> augment_df, then last session aggregations
+(player stats, teammates, team & squads aggregated stats), on the backend set in conf.toml [APP_BEHAVIOR] frame_backend
+
+- "pandas" : src/api_format.py & src/session_details.py, as is
+- "polars" : the same steps on Polars frames (Arrow memory, expressions run multi-threaded). Frames are
+  converted to pandas only at the rendering boundary (or to be handed to pandas-only modules : sessions
+  history, kd history), with the very same columns, values and dtypes as the pandas backend.
+  Flattening API results (res_to_df) is not a Polars step : both backends share the single python pass of
+  api_format.flatten_records(), Polars columns are built from its output. Nested entries kept as python objects
+  (loadouts, awards...) would become structs in a native build (pl.from_dicts + unnest), with every key of every
+  record : not the same values as pandas
+- Falls back to pandas if polars is not installed
+
+Usage:
+    frames = get_frames(CONF)
+    df = frames.augment_df(frames.format_df(frames.res_to_df(res, CONF), CONF, LABELS), LABELS)
+    rendering.xxx(frames.to_pandas(df))
+"""
+
+
+class PandasFrames:
+    """pandas backend : our api_format & session_details functions"""
+
+    name = "pandas"
+
+    res_to_df = staticmethod(api_format.res_to_df)
+    format_df = staticmethod(api_format.format_df)
+    augment_df = staticmethod(api_format.augment_df)
+    player_stats = staticmethod(session_details.player_stats)
+    team_rows = staticmethod(session_details.team_rows)
+    coplay_counts = staticmethod(session_details.coplay_counts)
+    get_teammates = staticmethod(session_details.get_teammates)
+    team_aggregated_stats = staticmethod(session_details.team_aggregated_stats)
+    squads_aggregated_stats = staticmethod(session_details.squads_aggregated_stats)
+
+    @staticmethod
+    def to_pandas(df):
+        return df
+
+
+def _to_series(name, values):
+    """--> pl.Series, a column of api_format.flatten_records() ; missing values (NaN) as nulls
+
+    Nested entries (dicts, lists) and mixed types are kept as python objects, as pandas would
+    """
+    if isinstance(values, np.ndarray):
+        return pl.Series(name, values, nan_to_null=True)
+    values = [None if api_format._is_null(value) else value for value in values]
+    types = {type(value) for value in values if value is not None}
+    if types & {dict, list} or (str in types and len(types) > 1):
+        return pl.Series(name, values, dtype=pl.Object)
+    return pl.Series(name, values, strict=False)
+
+
+def _downcast_int(col):
+    """--> pl.DataType, api_format._downcast_int() : Int32 (Int64 if needed), Float64 if any is missing (or not an int)"""
+    if col.null_count() or (col.dtype.is_float() and not col.round(0).equals(col)):
+        return pl.Float64
+    info = np.iinfo("int32")
+    if info.min <= col.min() and col.max() <= info.max:
+        return pl.Int32
+    return pl.Int64
+
+
+def _to_clock(col, with_seconds=True):
+    """--> expression, api_format.to_clock() : duration in seconds as 'MM:SS' (or 'MM')"""
+    total = col.cast(pl.Float64).floor().cast(pl.Int64)
+    clock = (total % 3600 // 60).cast(pl.Utf8).str.zfill(2)
+    if with_seconds:
+        clock = pl.concat_str(
+            [clock, pl.lit(":"), (total % 60).cast(pl.Utf8).str.zfill(2)]
+        )
+    return clock
+
+
+def _map_unique(col, func, dtype):
+    """--> pl.Series, func(value) for every value of col, computed once per distinct value (nulls stay null)"""
+    mapping = {value: func(value) for value in col.drop_nulls().unique().to_list()}
+    return col.replace(mapping, return_dtype=dtype)
+
+
+def _to_strings(values):
+    """--> list, str values, anything else (NaN...) as None"""
+    return [value if isinstance(value, str) else None for value in values]
+
+
+class PolarsFrames:
+    """polars backend : api_format & session_details steps, as Polars expressions"""
+
+    name = "polars"
+
+    @staticmethod
+    def res_to_df(res, CONF):
+        """--> pl.DataFrame, api_format.res_to_df() : same single pass flattening (python), then compact dtypes
+
+        Only the columns are built by Polars : format_df() and later steps are the Polars (multi-threaded) ones
+        """
+        n_loadouts = CONF.get("API_OUTPUT_FORMAT")["n_loadouts"]
+        columns = api_format.flatten_records(res, n_loadouts)
+        df = pl.DataFrame(
+            [_to_series(name, values) for name, values in columns.items()]
+        )
+        return PolarsFrames.enforce_dtypes(df, CONF)
+
+    @staticmethod
+    def enforce_dtypes(df, CONF):
+        """--> pl.DataFrame, api_format.enforce_dtypes() : dtypes declared in conf.toml [API_OUTPUT_FORMAT]"""
+        conf_format = CONF.get("API_OUTPUT_FORMAT")
+        casts = {}
+        for col in conf_format.get("int_cols", []):
+            if col in df.columns and df[col].dtype.is_numeric():
+                casts[col] = _downcast_int(df[col])
+        for col in conf_format.get("float_cols", []):
+            if col in df.columns and df[col].dtype.is_numeric():
+                casts[col] = pl.Float64
+        for col in conf_format.get("category_cols", []):
+            if col in df.columns and df[col].dtype == pl.Utf8:
+                casts[col] = pl.Categorical
+        return df.with_columns(pl.col(col).cast(dtype) for col, dtype in casts.items())
+
+    @staticmethod
+    def format_df(df, CONF, LABELS):
+        """--> pl.DataFrame, api_format.format_df() : readable timestamps, durations, loadouts, modes"""
+        columns = [
+            _map_unique(df[ts_col], datetime.fromtimestamp, pl.Datetime("us"))
+            for ts_col in CONF["API_OUTPUT_FORMAT"]["ts_cols"]
+        ]
+
+        # Loadouts / missions entries are python objects : parsed once per row, names once per loadout
+        resolver = api_format.get_loadout_resolver(LABELS)
+        for col in df.columns:
+            if col.startswith("loadout_"):
+                loadouts = _to_strings(map(resolver.parse, df[col].to_list()))
+                columns.append(
+                    pl.Series(col, loadouts, dtype=pl.Utf8).cast(pl.Categorical)
+                )
+        for col in LABELS.get("missions")["types"]:
+            if col in df.columns:
+                counts = [
+                    value.get("count") if isinstance(value, dict) else None
+                    for value in df[col].to_list()
+                ]
+                columns.append(pl.Series(col, counts, dtype=pl.Float64).cast(pl.Int64))
+
+        mapping = api_format.modes_mapping(LABELS)
+        modes = _map_unique(
+            df["mode"].cast(pl.Utf8), lambda mode: mapping.get(mode, mode), pl.Utf8
+        )
+        columns.append(modes.cast(pl.Categorical))
+
+        return df.with_columns(
+            *columns,
+            # API duration is in seconds x1000, API timePlayed in seconds
+            _to_clock(pl.col("duration") // 1000, with_seconds=False),
+            _to_clock(pl.col("timePlayed")),
+        )
+
+    @staticmethod
+    def augment_df(df, LABELS):
+        """--> pl.DataFrame, api_format.augment_df() : gulagStatus (W / L) entry"""
+        if "gulagKills" not in df.columns:
+            return df
+
+        # no gulag out of battle royale, whatever the API returns
+        no_gulag_modes = list(LABELS.get("modes")["others"].values()) + list(
+            LABELS.get("modes")["resurgence"].values()
+        )
+        no_gulag = pl.col("mode").cast(pl.Utf8).is_in(no_gulag_modes)
+        df = df.with_columns(
+            pl.when(no_gulag).then(None).otherwise(pl.col(col)).alias(col)
+            for col in ("gulagKills", "gulagDeaths")
+        )
+        # as pandas, int columns with missing values are floats
+        df = df.with_columns(
+            pl.col(col).cast(pl.Float64)
+            for col in ("gulagKills", "gulagDeaths")
+            if df[col].dtype.is_integer() and df[col].null_count()
+        )
+
+        kills, deaths = pl.col("gulagKills"), pl.col("gulagDeaths")
+        # same filters as api_format.add_gulag_status(), whose np.select() default is the string 'nan'
+        gulag_status = (
+            pl.when(kills.is_null())
+            .then(None)
+            .when((kills == 1) & (deaths == 1))
+            .then(pl.lit("W"))
+            .when((kills == 0) & (deaths == 0))
+            .then(pl.lit("W"))
+            .when((kills == 1) & (deaths == 0))
+            .then(pl.lit("W"))
+            .when((kills == 0) & (deaths >= 1))
+            .then(pl.lit("L"))
+            .otherwise(pl.lit("nan"))
+        )
+        return df.with_columns(gulag_status.alias("gulagStatus"))
+
+    @staticmethod
+    def player_stats(last_session_formatted, gamertag):
+        """--> pl.DataFrame, session_details.player_stats() : app's user stats only"""
+        visible_cols = [
+            "utcEndSeconds",
+            "mode",
+            "teamPlacement",
+            "kills",
+            "deaths",
+            "assists",
+        ]
+        return last_session_formatted.filter(pl.col("username") == gamertag).select(
+            visible_cols
+        )
+
+    @staticmethod
+    def team_rows(last_session_formatted, gamertag):
+        """--> pl.DataFrame, session_details.team_rows()"""
+        pair = pl.concat_str(
+            [pl.col("matchID").cast(pl.Utf8), pl.col("team").cast(pl.Utf8)],
+            separator="|",
+        )
+        player_pairs = last_session_formatted.filter(
+            pl.col("username") == gamertag
+        ).select(pair)
+        return last_session_formatted.filter(pair.is_in(player_pairs.to_series()))
+
+    @staticmethod
+    def coplay_counts(team_session):
+        """--> dict, session_details.coplay_counts()"""
+        coplay = dict(
+            team_session.group_by(pl.col("username").cast(pl.Utf8))
+            .agg(pl.col("matchID").n_unique())
+            .iter_rows()
+        )
+        return {
+            teammate: coplay[teammate] for teammate in sorted(coplay, key=str.lower)
+        }
+
+    @staticmethod
+    def get_teammates(last_session_formatted, gamertag, counts=False):
+        """--> list(str) (or dict, counts=True), session_details.get_teammates()"""
+        coplay = PolarsFrames.coplay_counts(
+            PolarsFrames.team_rows(last_session_formatted, gamertag)
+        )
+
+        if counts:
+            return coplay
+        return list(coplay)
+
+    @staticmethod
+    def aggregated_stats(last_session_formatted, by="username", *extra):
+        """--> pl.DataFrame, session_details.aggregated_stats() : a single group by ; extra : more expressions"""
+        wins = (pl.col("gulagStatus") == "W").sum()
+        entries = pl.col("gulagStatus").is_in(["W", "L"]).sum()
+        gulag_ratio = pl.when(wins > 0).then(wins / entries).otherwise(0.0)
+
+        schema = last_session_formatted.schema
+        return (
+            last_session_formatted.with_columns(pl.col("loadout_1").cast(pl.Utf8))
+            .group_by(by)
+            .agg(
+                pl.col("mode").count().cast(pl.Int64).alias("played"),
+                # loadout (1) of the game with the highest kd
+                pl.col("loadout_1")
+                .filter(pl.col("kdRatio") == pl.col("kdRatio").max())
+                .first()
+                .alias("loadoutBest"),
+                # as pandas group by sums, in the columns dtype
+                *(
+                    pl.col(col).sum().cast(schema[col])
+                    for col in ("kills", "deaths", "assists")
+                ),
+                pl.col("damageDone", "damageTaken").mean(),
+                gulag_ratio.alias("gulagStatus"),
+                *extra,
+            )
+            .with_columns((pl.col("kills") / pl.col("deaths")).alias("kdRatio"))
+        )
+
+    @staticmethod
+    def team_aggregated_stats(team_session, coplay):
+        """--> pl.DataFrame, session_details.team_aggregated_stats()"""
+        team_session = (
+            PolarsFrames.aggregated_stats(team_session)
+            .with_columns(
+                pl.col("username")
+                .cast(pl.Utf8)
+                .replace(coplay, return_dtype=pl.Int64)
+                .alias("played"),
+                pl.concat_str(
+                    [
+                        (pl.col("gulagStatus") * 100).cast(pl.Int64).cast(pl.Utf8),
+                        pl.lit(" %"),
+                    ]
+                ).alias("gulagStatus"),
+            )
+            .sort(pl.col("username").cast(pl.Utf8).str.to_lowercase())
+        )
+        # Remove some of random people you played with
+        return team_session.sort("played", descending=True, maintain_order=True).head(4)
+
+    @staticmethod
+    def squads_aggregated_stats(last_session_formatted):
+        """--> pl.DataFrame, session_details.squads_aggregated_stats()"""
+        username = pl.col("username").cast(pl.Utf8)
+        squads = PolarsFrames.aggregated_stats(
+            last_session_formatted,
+            ["matchID", "team"],
+            pl.col("utcEndSeconds").first(),
+            pl.col("teamPlacement").min(),
+            username.sort_by(username.str.to_lowercase())
+            .str.concat(" | ")
+            .alias("players"),
+        ).rename({"played": "size"})
+
+        first_cols = ["matchID", "utcEndSeconds", "team", "teamPlacement", "players"]
+        return squads.select(
+            *first_cols, pl.exclude(first_cols)
+        ).sort(  # last match first ; ties as pandas : alphabetical matchID, team
+            [
+                pl.col("utcEndSeconds"),
+                pl.col("matchID").cast(pl.Utf8),
+                pl.col("teamPlacement"),
+                pl.col("team").cast(pl.Utf8),
+            ],
+            descending=[True, False, False, False],
+        )
+
+    @staticmethod
+    def to_pandas(df):
+        """--> pd.DataFrame, as the pandas backend would have returned it (dtypes, categories order)"""
+        pandas_df = df.to_pandas()
+        for col, dtype in df.schema.items():
+            if dtype == pl.Categorical:
+                categories = pandas_df[col].cat.categories
+                pandas_df[col] = pandas_df[col].cat.reorder_categories(
+                    sorted(categories)
+                )
+            elif dtype == pl.Datetime:
+                pandas_df[col] = pandas_df[col].astype("datetime64[ns]")
+            elif dtype.is_integer() and df[col].null_count():
+                # missions counts, nullable ints
+                pandas_df[col] = pandas_df[col].astype("Int64")
+            elif dtype == pl.Utf8 and df[col].null_count() == len(df):
+                # pandas infers missing values only (e.g. gulagStatus out of battle royale) as floats
+                pandas_df[col] = pandas_df[col].astype("float64")
+        return pandas_df
+
+
+def get_frames(CONF):
+    """--> PandasFrames or PolarsFrames, backend set in conf.toml [APP_BEHAVIOR] frame_backend
+
+    pandas if not set, or if polars is not installed
+    """
+    backend = CONF.get("APP_BEHAVIOR", {}).get("frame_backend", "pandas")
+    if backend == "polars" and POLARS_AVAILABLE:
+        return PolarsFrames
+    return PandasFrames
@@ -1,3 +1,7 @@
+import collections
+import math
+
+import numpy as np
 import pandas as pd
 
 from src import kd_history
@@ -9,7 +13,8 @@ Light time series treatment(s) on some Warzone historical KPIs like Kills/Deaths
 
 - Before that we collected a matches history
 - Also our API output (detailed matches stats) was already converted to a df, flattened and formated to be readable / operable (using api_format module)
-- 
+- KpiEngine : the same KPIs (cumulative kd, expanding & moving averages, gulag win %) updated match after match,
+  in O(1). Its state can be persisted per player & mode (cache.KpiStore) : a refresh only goes through new matches
 """
 
 
@@ -63,27 +68,227 @@ def add_gulag_pct(df):
 def extract_last_cum_kd(data):
     """
     Extract last cum kd from br, resu, others last recent matches
+
+    data : dict, {label: matches}, either histories (see to_histories) or raw partitions (not modified)
     """
     cum_kd = dict()
     for label in ["Battle Royale", "Resurgence", "Others"]:
-        if len(data.get(label)) >= 1:
-            df_cum_kd = kd_history.add_cumulative_kd(data.get(label))
-            cum_kd[label] = round(df_cum_kd["kdRatioCum"].tolist()[-1], 2)
+        df = data.get(label)
+        if df is not None and len(df) >= 1:
+            if "kdRatioCum" not in df.columns:
+                df = kd_history.add_cumulative_kd(df.copy())
+            cum_kd[label] = round(df["kdRatioCum"].tolist()[-1], 2)
         else:
             cum_kd[label] = 1
 
     return cum_kd
 
 
-def to_history(df, **kwargs):
-    """Pipe the functions above to get our desired "time" series"""
+def _ratio(numerator, denominator):
+    """--> float, numerator / denominator as pandas would : x/0 is inf, 0/0 and missing values NaN"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return float(np.float64(numerator) / np.float64(denominator))
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+class KpiEngine:
+    """Online (streaming) version of to_history() KPIs : every new match updates them in O(1)
+
+    Matches must come from least recent to last. Same KPIs as the add_xxx functions above (same quirks), i.e.
+    kills / deaths cumulative sums & kd, kills / damage expanding averages, kd / kills / damage moving averages
+    over the last `window` matches, gulag W cumulative count & win %
+    """
+
+    averaged = ("kills", "damageDone")
+    rolled = ("kdRatio", "kills", "damageDone")
+    summed = ("kills", "deaths")
+
+    def __init__(self, window=5):
+        self.window = window
+        self.rows = 0
+        self.wins = 0
+        # cumulative sums skip missing values, as pandas does
+        self.sums = dict.fromkeys(set(self.averaged + self.summed), 0)
+        self.counts = dict.fromkeys(self.averaged, 0)
+        self.windows = {col: collections.deque(maxlen=window) for col in self.rolled}
+        # utcStartSeconds (epoch seconds) of the last match
+        self.last_start = None
+
+    def state(self):
+        """--> dict, json serializable state"""
+        return {
+            "window": self.window,
+            "rows": self.rows,
+            "wins": self.wins,
+            "sums": self.sums,
+            "counts": self.counts,
+            "windows": {col: list(values) for col, values in self.windows.items()},
+            "last_start": self.last_start,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """--> KpiEngine, resumed from a state()"""
+        engine = cls(window=state["window"])
+        engine.rows, engine.wins = state["rows"], state["wins"]
+        engine.sums.update(state["sums"])
+        engine.counts.update(state["counts"])
+        for col, values in state["windows"].items():
+            engine.windows[col].extend(values)
+        engine.last_start = state["last_start"]
+        return engine
+
+    def _moving_avg(self, col):
+        values = [value for value in self.windows[col] if not _is_missing(value)]
+        if not values:
+            return math.nan
+        return round(math.fsum(values) / len(values), 2)
+
+    def update(self, match):
+        """Add a match (mapping of its stats), more recent than the previous ones --> dict, its KPIs"""
+        for col in self.sums:
+            if not _is_missing(match[col]):
+                self.sums[col] += match[col]
+                if col in self.counts:
+                    self.counts[col] += 1
+
+        kpis = {}
+        for col in self.summed:
+            missing = _is_missing(match[col])
+            kpis[f"{col}_cumsum"] = math.nan if missing else self.sums[col]
+        kpis["kdRatioCum"] = _ratio(kpis["kills_cumsum"], kpis["deaths_cumsum"])
+
+        for col in self.averaged:
+            kpis[f"{col}CumAvg"] = (
+                self.sums[col] / self.counts[col] if self.counts[col] else math.nan
+            )
+
+        for col in self.rolled:
+            value = match[col]
+            self.windows[col].append(None if _is_missing(value) else float(value))
+            kpis[f"{col}RollAvg"] = self._moving_avg(col)
+
+        self.wins += match["gulagStatus"] == "W"
+        # as add_gulag_pct() : W count / (0-based) row index
+        kpis["W_cumsum"] = self.wins
+        kpis["rows_count"] = self.rows
+        kpis["gulagWinPct"] = _ratio(self.wins * 100, self.rows)
+
+        self.rows += 1
+        self.last_start = match["utcStartSeconds"]
+        return kpis
+
+
+# KpiEngine KPIs, in to_history() columns order
+KPI_COLUMNS = [
+    "kills_cumsum",
+    "deaths_cumsum",
+    "kdRatioCum",
+    "killsCumAvg",
+    "damageDoneCumAvg",
+    "kdRatioRollAvg",
+    "killsRollAvg",
+    "damageDoneRollAvg",
+    "W_cumsum",
+    "rows_count",
+    "gulagWinPct",
+]
+
+
+def _engine_inputs(df, starts):
+    """--> list(dict), stats KpiEngine reads, per match (starts : utcStartSeconds as epoch seconds)"""
+    cols = ["kills", "deaths", "damageDone", "kdRatio", "gulagStatus"]
+    inputs = df[cols].astype(object).to_dict(orient="records")
+    for match, start in zip(inputs, starts.tolist()):
+        match["utcStartSeconds"] = start
+    return inputs
+
+
+def _with_kpis(df, kpis):
+    """--> df with KPIs columns (list of dict, one per row), dtypes as the add_xxx functions above"""
+    columns = {}
+    for col in KPI_COLUMNS:
+        values = np.array([row[col] for row in kpis], dtype="float64")
+        if col in ("W_cumsum", "rows_count") or (
+            col in ("kills_cumsum", "deaths_cumsum")
+            and pd.api.types.is_integer_dtype(df[col.replace("_cumsum", "")])
+        ):
+            values = values.astype("int64")
+        columns[col] = values
+    kpis_df = pd.DataFrame(columns, index=df.index)
+    return pd.concat([df.drop(columns=KPI_COLUMNS, errors="ignore"), kpis_df], axis=1)
+
+
+def resume_history(df, store, key, window=5):
+    """to_history(), KPIs resumed from a cache.KpiStore : only matches not seen yet go through KpiEngine
+
+    Cumulative KPIs span every match seen for this key, not only df's. If a match older than the last seen one
+    shows up (or the window changed), KPIs start over from df
+    """
+
+    df = add_sorted_index(df)
+    match_ids = df["matchID"].astype(str).tolist()
+    starts = df["utcStartSeconds"].to_numpy(dtype="datetime64[s]").astype("int64")
+
+    state = store.get_state(*key)
+    resumed = state is not None and state["window"] == window
+    engine = KpiEngine.from_state(state) if resumed else KpiEngine(window)
+    known = store.get_rows(*key, match_ids) if resumed else {}
+
+    new = [pos for pos, match_id in enumerate(match_ids) if match_id not in known]
+    older = bool(new) and resumed and starts[new].min() <= engine.last_start
+    if older:
+        engine, known, new = KpiEngine(window), {}, list(range(len(df)))
+
+    computed = {
+        match_ids[pos]: engine.update(match)
+        for pos, match in zip(new, _engine_inputs(df.iloc[new], starts[new]))
+    }
+    if computed:
+        replace = state is not None and (older or not resumed)
+        store.save(*key, engine.state(), computed, replace=replace)
+
+    kpis = [known.get(match_id) or computed[match_id] for match_id in match_ids]
+    return _with_kpis(df, kpis)
+
+
+def to_history(df, store=None, key=None, window=5):
+    """Pipe the functions above to get our desired "time" series
+
+    store, key : cache.KpiStore and (platform, username, mode type) : KPIs resumed from the previous refresh,
+    see resume_history()
+    """
+
+    if store is not None:
+        return resume_history(df, store, key, window=window)
 
     df = (
         df.pipe(add_sorted_index)
-        .pipe(add_cumulative_avg)
-        .pipe(add_moving_avg)
         .pipe(add_cumulative_kd)
+        .pipe(add_cumulative_avg)
+        .pipe(add_moving_avg, window=window)
         .pipe(add_gulag_pct)
     )
 
     return df
+
+
+def to_histories(data, store=None, player=None, **kwargs):
+    """--> dict, {label: "time" series}, to_history() computed once per (non empty) partition of matches
+
+    Used by the charts (the benchmarks, extract_last_cum_kd, run on the displayed matches only)
+    store, player : cache.KpiStore and (platform, username), to resume KPIs from the previous refresh
+    """
+    return {
+        label: to_history(
+            df,
+            store=store,
+            key=(*player, label) if store is not None else None,
+            **kwargs,
+        )
+        for label, df in data.items()
+        if len(df)
+    }
@@ -0,0 +1,228 @@
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import httpx
+
+"""
+Inside
+-----
+Client-side limits, to get data from COD API as fast as it allows without being throttled
+
+- AdaptiveLimiter : AIMD-style concurrency limit. In-flight requests limit grows while responses succeed,
+  is cut on 429 / 5xx responses, and every request waits out a Retry-After server hint
+- TokenBucket / RateLimiter : process-wide request rate budget per endpoint (profile, matches pages, match),
+  every request to the API draws from it, whatever the user / session. Queue wait is measured
+- Helpers to read throttling signals (status, Retry-After) from httpx errors
+"""
+
+
+def is_throttled(exc):
+    """--> bool, exception is a "slow down" signal from the server : 429 Too Many Requests or 5xx"""
+    if not isinstance(exc, httpx.HTTPStatusError):
+        return False
+    status = exc.response.status_code
+    return status == 429 or status >= 500
+
+
+def retry_after(exc):
+    """--> float (seconds) or None, server Retry-After hint of an httpx.HTTPStatusError
+
+    Retry-After is either a number of seconds or an HTTP date
+    """
+    if not isinstance(exc, httpx.HTTPStatusError):
+        return None
+    value = exc.response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """AIMD (additive increase, multiplicative decrease) concurrency limit, used as an async context manager
+
+        async with limiter:
+            r = await self.GetMatch(...)
+
+    - a success increases the limit by `increase / limit` : about +`increase` per "window" of successes
+    - a throttled response (429, 5xx) multiplies it by `decrease`, at most once per `cooldown` seconds
+      (concurrent in-flight failures are the same congestion event), and honors Retry-After if any
+    """
+
+    def __init__(
+        self, initial=2, minimum=1, maximum=8, increase=1.0, decrease=0.5, cooldown=1.0
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._last_decrease = 0.0
+        # asyncio primitives are bound to a loop : created lazily, from within the (service) loop
+        self._condition = None
+
+    @classmethod
+    def from_conf(cls, CONF, endpoint="match"):
+        """--> AdaptiveLimiter, settings from conf.toml [API_CONCURRENCY.<endpoint>]"""
+        return cls(**CONF.get("API_CONCURRENCY", {}).get(endpoint, {}))
+
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def __aenter__(self):
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                wait = self.blocked_until - time.monotonic()
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(condition.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    await condition.wait()
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if exc is None:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            elif is_throttled(exc):
+                if now - self._last_decrease > self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = now
+                delay = retry_after(exc)
+                if delay:
+                    self.blocked_until = max(self.blocked_until, now + delay)
+            condition.notify_all()
+        return False
+
+    def stats(self):
+        """--> dict, current state, e.g. to monitor how far the upstream lets us go"""
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+        }
+
+
+class TokenBucket:
+    """Token bucket rate limit : `rate` requests per second on average, bursts of up to `burst` requests
+
+    Requests are served first-come first-served ; time spent waiting for a token is recorded,
+    see stats(), to tell when we are saturated
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        # asyncio.Lock is FIFO ; created lazily, from within the (service) loop
+        self._lock = None
+
+        # metrics
+        self.queued = 0
+        self.acquired = 0
+        self.waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait for, then consume, one token"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        start = time.monotonic()
+        self.queued += 1
+        try:
+            async with self._lock:
+                self._refill()
+                if self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    self._refill()
+                self.tokens -= 1
+        finally:
+            self.queued -= 1
+
+        wait = time.monotonic() - start
+        self.acquired += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        if wait > 0.001:
+            self.waited += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def stats(self):
+        """--> dict, queue wait metrics"""
+        return {
+            "queued": self.queued,
+            "acquired": self.acquired,
+            "waited_pct": round(self.waited * 100 / self.acquired, 1)
+            if self.acquired
+            else 0,
+            "wait_avg": round(self.wait_total / self.acquired, 3)
+            if self.acquired
+            else 0,
+            "wait_max": round(self.wait_max, 3),
+            "tokens": round(min(self.burst, self.tokens), 2),
+        }
+
+
+class RateLimiter:
+    """One TokenBucket per API endpoint ; endpoints without a bucket are not rate limited"""
+
+    def __init__(self, buckets=None):
+        """buckets : dict, {endpoint: TokenBucket}"""
+        self.buckets = buckets or {}
+
+    @classmethod
+    def from_conf(cls, CONF):
+        """--> RateLimiter, buckets as set in conf.toml [API_RATE_LIMITS.<endpoint>] (rate, burst)"""
+        return cls(
+            {
+                endpoint: TokenBucket(**params)
+                for endpoint, params in CONF.get("API_RATE_LIMITS", {}).items()
+            }
+        )
+
+    async def acquire(self, endpoint):
+        bucket = self.buckets.get(endpoint)
+        if bucket is not None:
+            await bucket.acquire()
+
+    def stats(self):
+        """--> dict, {endpoint: queue wait metrics}"""
+        return {endpoint: bucket.stats() for endpoint, bucket in self.buckets.items()}
@@ -1,6 +1,115 @@
+import pandas as pd
+
 from src import utils
 from src import api_format
 
+"""
+Inside
+-----
+Match(es) details : placement, team kills, kills share & rank, top players, quartiles, for a player
+
+- Per-match functions below (one lobby, filtered by gamertag / team at each call), e.g. for a single match page
+- lobby_analytics() : the same figures for every match of a lobby frame (several matches, e.g. a whole
+  session) at once, from a single (matchID, team) group by, as tables indexed by matchID (last session view)
+"""
+
+
+def _loadout_cols(df):
+    return df.columns[df.columns.str.startswith("loadout")].tolist()
+
+
+def lobby_analytics(df, gamertag, LABELS, top=5):
+    """Per-match and per-team aggregates of a lobby frame (one or several matches), in one grouped pass
+
+    Parameters
+    ----------
+    df : DataFrame, formatted matches (api_format.res_to_df, format_df, augment_df), every player of every lobby
+    gamertag : str, matches (and teams) are described from this player's side
+    LABELS : dict, to parse loadouts of top players
+    top : int, top players (by kills) kept per match
+
+    Returns
+    -------
+    dict of DataFrames
+        "teams" : indexed by (matchID, team), teamPlacement, kills, deaths, assists, kdRatio, killsShare (% of
+            the lobby kills), killsRank (0 : most kills of the lobby, tied teams share the best rank)
+        "matches" : indexed by matchID (frame order), gamertag's team, end time, mode, placement,
+            kills / deaths / assists / kdRatio, team kills / kd / kills share / kills rank, lobby kills
+        "top_players" : top players of each match by kills (then kd), indexed by matchID
+        "quartiles" : indexed by matchID, kills & kdRatio stats (count, mean, std, min, quartiles, max)
+    """
+
+    teams = df.groupby(["matchID", "team"], observed=True).agg(
+        teamPlacement=("teamPlacement", "min"),
+        kills=("kills", "sum"),
+        deaths=("deaths", "sum"),
+        assists=("assists", "sum"),
+    )
+    teams["kdRatio"] = teams.kills / teams.deaths
+    by_match = teams.groupby(level="matchID", observed=True)["kills"]
+    lobby_kills = by_match.transform("sum")
+    teams["killsShare"] = teams.kills * 100 / lobby_kills
+    teams["killsRank"] = by_match.rank(method="min", ascending=False).astype(int) - 1
+
+    player = df.loc[
+        df["username"] == gamertag,
+        [
+            "matchID",
+            "team",
+            "utcEndSeconds",
+            "mode",
+            "teamPlacement",
+            "kills",
+            "deaths",
+            "assists",
+            "kdRatio",
+        ],
+    ].set_index(["matchID", "team"])
+    team_cols = ["kills", "deaths", "kdRatio", "killsShare", "killsRank"]
+    matches = player.join(
+        teams[team_cols].rename(columns=lambda col: "team" + col[0].upper() + col[1:])
+    )
+    matches["lobbyKills"] = lobby_kills.loc[matches.index]
+    matches = matches.reset_index(level="team")
+
+    top_players = (
+        df.sort_values(by=["kills", "kdRatio"], ascending=False, kind="stable")
+        .groupby("matchID", observed=True)
+        .head(top)[
+            ["matchID", "username", "team", "kdRatio", "kills", "deaths", "assists"]
+            + _loadout_cols(df)
+        ]
+        .sort_values(by="matchID", kind="stable")
+        .set_index("matchID")
+    )
+    resolver = api_format.get_loadout_resolver(LABELS)
+    for col in _loadout_cols(top_players):
+        top_players[col] = resolver.parse_column(top_players[col])
+
+    # as DataFrame.describe(), without its loop over groups
+    players_by_match = df.groupby("matchID", observed=True)[["kills", "kdRatio"]]
+    quantiles = players_by_match.quantile([0.25, 0.5, 0.75]).unstack()
+    quantiles.columns = [(col, f"{q:.0%}") for col, q in quantiles.columns]
+    quartiles = pd.concat(
+        [players_by_match.agg(["count", "mean", "std", "min", "max"]), quantiles],
+        axis=1,
+    )
+    quartiles = quartiles[
+        pd.MultiIndex.from_product(
+            [
+                ["kills", "kdRatio"],
+                ["count", "mean", "std", "min", "25%", "50%", "75%", "max"],
+            ]
+        )
+    ]
+
+    return {
+        "teams": teams,
+        "matches": matches,
+        "top_players": top_players,
+        "quartiles": quartiles,
+    }
+
 
 def get_placement(df, gamertag):
     """--> int, Retrieve final placement of a player/his team"""
@@ -18,9 +127,9 @@ def teamKills(df, gamertag, LABELS):
     """Return a DataFrame with Team players and team total KD, K/D/A ; also Loadouts"""
 
     team = utils.get_team(df, gamertag)
-    keep_cols = ["username", "kdRatio", "kills", "deaths", "assists"] + df.columns[
-        df.columns.str.startswith("loadout")
-    ].tolist()
+    keep_cols = ["username", "kdRatio", "kills", "deaths", "assists"] + _loadout_cols(
+        df
+    )
     df_team = df[df["team"] == team][keep_cols].sort_values("kills", ascending=False)
 
     # add Team aggregated stats final row
@@ -31,15 +140,19 @@ def teamKills(df, gamertag, LABELS):
 
     row_total.update({"username": "team"})
     row_total.update({"kdRatio": team_kd})
-    df_team = df_team.append(row_total, ignore_index=True)
+    df_team = pd.concat([df_team, pd.DataFrame([row_total])], ignore_index=True)
     df_team[["kills", "deaths", "assists"]] = df_team[
         ["kills", "deaths", "assists"]
     ].astype(int)
-    df_team.fillna("-", inplace=True)
+    # categorical columns (compact dtypes) would not accept "-"
+    df_team = df_team.astype(
+        {col: "object" for col in df_team.select_dtypes("category").columns}
+    ).fillna("-")
 
-    # Convert COD weapons code names, using labels.py , parse_weapons()
+    # Convert COD weapons code names, using wz_labels.json (memoized : same loadouts as the match df)
+    resolver = api_format.get_loadout_resolver(LABELS)
     for col in df_team.columns[df_team.columns.str.startswith("loadout")]:
-        df_team[col] = df_team[col].map(lambda x: api_format.parse_loadout(x, LABELS))
+        df_team[col] = resolver.parse_column(df_team[col])
     return df_team
 
 
@@ -53,7 +166,7 @@ def teamPercentageKills(df, gamertag):
 def teamKillsPlacement(df, gamertag):
     """Retrieve final placement according to # kills, of a player/his team"""
     index = (
-        df.groupby("team")[["kills"]]
+        df.groupby("team", observed=True)[["kills"]]
         .sum()
         .sort_values("kills", ascending=False)
         .reset_index()
@@ -74,8 +187,9 @@ def topPlayers(df, LABELS):
     ] + df.columns[df.columns.str.startswith("loadout")].tolist()
     df_top = df.sort_values(by="kills", ascending=False)[0:5][keep_cols]
 
+    resolver = api_format.get_loadout_resolver(LABELS)
     for col in df_top.columns[df_top.columns.str.startswith("loadout")]:
-        df_top[col] = df_top[col].map(lambda x: api_format.parse_loadout(x, LABELS))
+        df_top[col] = resolver.parse_column(df_top[col])
     return df_top
 
 
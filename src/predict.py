@@ -4,9 +4,11 @@ import pandas as pd
 import numpy as np
 import datetime
 from datetime import datetime
+import hashlib
+import os
 import pickle
-
-import streamlit as st
+import threading
+import time
 
 
 from sklearn.preprocessing import OneHotEncoder
@@ -25,8 +27,135 @@ Notes on "lobby kd" & observed variance :
 - "lobby kd" calculated as : average [players' kills/deaths )
 - Usually wzranked computes it from 50 to 90 % known player seasonal (resurgence) k/d, so 'true' lobby kd varies
 - Our model has a mean rmse of += [0.09 - 0.1] ; FYI "lobby k/d" usually navigates between 0.6 (rare) and 1.5 (rare)
+
+Model artifacts (XGBoost model, "map" one hot encoder) are loaded and validated once per process, then shared by
+every session / thread (ModelRegistry, get_registry()). They are reloaded if their file changes on disk.
+A match lobby kd only depends on the match : predictions are stored per (matchID, model version), see lobby_kd()
 """
 
+# Model artifacts, fit when we built our model
+MODEL_FILES = {
+    "lobby_kd": "src/model/xgb_model_lobby_kd_2.json",
+    "map_encoder": "src/model/ohe_encoder.pickle",
+}
+
+
+def load_lobby_kd_model(path):
+    """--> xgb.XGBRegressor, loaded from its json file, raise ValueError if it has no features"""
+    model = xgb.XGBRegressor()
+    model.load_model(path)
+    if not model.get_booster().num_features():
+        raise ValueError(f"{path} : model without features")
+    return model
+
+
+def load_map_encoder(path):
+    """--> OneHotEncoder, fit on the "map" column, raise ValueError otherwise"""
+    with open(path, "rb") as f:
+        enc = pickle.load(f)
+    if not isinstance(enc, OneHotEncoder) or list(enc.feature_names_in_) != ["map"]:
+        raise ValueError(f"{path} : not a OneHotEncoder of column 'map'")
+    return enc
+
+
+def file_digest(path):
+    """--> str, short sha1 of a file content, identifies an artifact version"""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:10]
+
+
+def artifact_size(artifact):
+    """--> int, bytes, in memory size of a model artifact (serialized size, as an estimate)"""
+    if isinstance(artifact, xgb.XGBModel):
+        return len(artifact.get_booster().save_raw())
+    return len(pickle.dumps(artifact))
+
+
+class ModelRegistry:
+    """Model artifacts loaded once, shared by every thread, reloaded when their file changes (mtime / size)
+
+    Usage:
+        model = get_registry().get("lobby_kd")
+    """
+
+    loaders = {"lobby_kd": load_lobby_kd_model, "map_encoder": load_map_encoder}
+
+    def __init__(self, files=None):
+        """files : dict, {artifact name: path}, MODEL_FILES by default"""
+        self.files = dict(files or MODEL_FILES)
+        self._lock = threading.Lock()
+        self._artifacts = {}  # name: (file signature, artifact)
+        self._stats = {}
+
+    @staticmethod
+    def _signature(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self, name, signature):
+        path = self.files[name]
+        start = time.perf_counter()
+        try:
+            artifact = self.loaders[name](path)
+        except Exception as exc:
+            if name not in self._artifacts:
+                raise
+            # a file being rewritten, or a bad one : keep serving the previous artifact, until the file changes again
+            self._stats[name]["error"] = repr(exc)
+            artifact = self._artifacts[name][1]
+            self._artifacts[name] = (signature, artifact)
+            return artifact
+
+        stats = self._stats.setdefault(name, {"path": path, "loads": 0})
+        stats.update(
+            loads=stats["loads"] + 1,
+            loaded_at=time.time(),
+            load_seconds=time.perf_counter() - start,
+            memory_bytes=artifact_size(artifact),
+            version=file_digest(path),
+            error=None,
+        )
+        self._artifacts[name] = (signature, artifact)
+        return artifact
+
+    def get(self, name):
+        """--> artifact (model, encoder), loaded at 1st call, reloaded if its file changed since"""
+        signature = self._signature(self.files[name])
+        loaded = self._artifacts.get(name)
+        if loaded is not None and loaded[0] == signature:
+            return loaded[1]
+        with self._lock:
+            loaded = self._artifacts.get(name)
+            # loaded meanwhile by another thread
+            if loaded is not None and loaded[0] == signature:
+                return loaded[1]
+            return self._load(name, signature)
+
+    def version(self):
+        """--> str, version of the artifacts currently served (reloaded first if needed), e.g. in stored predictions keys"""
+        for name in self.files:
+            self.get(name)
+        with self._lock:
+            return "-".join(self._stats[name]["version"] for name in sorted(self.files))
+
+    def stats(self):
+        """--> dict, {artifact name: path, loads count, loaded_at, load_seconds, memory_bytes, version, last reload error}"""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """--> ModelRegistry, created once per process (module state survives Streamlit reruns)"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+    return _registry
+
 
 def to_model_format(last_session: List[Dict]):
     """
@@ -138,8 +267,7 @@ def encode_features(df):
         ohe encoder previously fit when we built our model
         """
 
-        with open("src/model/ohe_encoder.pickle", "rb") as f:
-            enc = pickle.load(f)
+        enc = get_registry().get("map_encoder")
         encoded_features = enc.transform(df[[column]]).toarray()
 
         df_features = pd.DataFrame(encoded_features)
@@ -298,79 +426,47 @@ def perform_aggregations(df):
         "playerStats.headshots_by_kill",
     ]
 
-    # keep core features (do not vary per players) :
-
-    df_core = df.groupby("matchID")[no_agg_columns].agg("last")
-
-    # perform mean, std, median groupby-agg on other features:
-
-    df_detailed = df.groupby("matchID")[detailed_agg_columns].agg(
-        ["mean", "std", "median"]
-    )
-    df_detailed.columns = ["_".join(x) for x in df_detailed.columns]
-
-    # perform special aggregations (count of given variables among players of a match),
-    # adding new features :
-
-    pct_players_0_kills = (
-        df[["matchID", "playerStats.kills"]]
-        .groupby("matchID")[["playerStats.kills"]]
-        .apply(lambda x: (x == 0).sum())
-    )
-    pct_players_0_kills.columns = ["pct_players_0_kills"]
-    pct_players_5_kills = (
-        df[["matchID", "playerStats.kills"]]
-        .groupby("matchID")[["playerStats.kills"]]
-        .apply(lambda x: (x >= 5).sum())
-    )
-    pct_players_5_kills.columns = ["pct_players_5_kills"]
-    pct_players_10_kills = (
-        df[["matchID", "playerStats.kills"]]
-        .groupby("matchID")[["playerStats.kills"]]
-        .apply(lambda x: (x >= 10).sum())
-    )
-    pct_players_10_kills.columns = ["pct_players_10_kills"]
-
-    pct_players_with_streak_5 = (
-        df[["matchID", "player.awards.streak_5"]]
-        .groupby("matchID")[["player.awards.streak_5"]]
-        .apply(lambda x: (x.notnull()).sum() / len(x) * 100)
-    )
-    pct_players_with_streak_5.columns = ["pct_players_with_streak_5"]
+    # special aggregations (count of given variables among players of a match), adding new features :
+    # boolean indicators, summed per match
+    indicators = {
+        "pct_players_0_kills": df["playerStats.kills"] == 0,
+        "pct_players_5_kills": df["playerStats.kills"] >= 5,
+        "pct_players_10_kills": df["playerStats.kills"] >= 10,
+        "pct_players_with_streak_5": df["player.awards.streak_5"].notnull(),
+        "pct_players_with_double": df["player.awards.double"].notnull(),
+        "pct_players_with_headshots": df["playerStats.headshots"].notnull(),
+    }
+    # ... then as a % of the match players
+    pct_columns = [
+        "pct_players_with_streak_5",
+        "pct_players_with_double",
+        "pct_players_with_headshots",
+    ]
 
-    pct_players_with_double = (
-        df[["matchID", "player.awards.double"]]
-        .groupby("matchID")[["player.awards.double"]]
-        .apply(lambda x: (x.notnull()).sum() / len(x) * 100)
+    # every feature in a single group by :
+    # core features are kept (last value), others are aggregated using mean, std, median
+    aggregations = {col: (col, "last") for col in no_agg_columns}
+    aggregations.update(
+        {
+            f"{col}_{func}": (col, func)
+            for col in detailed_agg_columns
+            for func in ["mean", "std", "median"]
+        }
     )
-    pct_players_with_double.columns = ["pct_players_with_double"]
-
-    pct_players_with_headshots = (
-        df[["matchID", "playerStats.headshots"]]
-        .groupby("matchID")[["playerStats.headshots"]]
-        .apply(lambda x: (x.notnull()).sum() / len(x) * 100)
+    aggregations.update({col: (col, "sum") for col in indicators})
+    aggregations["n_players"] = ("matchID", "size")
+
+    df = (
+        df[["matchID"] + no_agg_columns + detailed_agg_columns]
+        .assign(**indicators)
+        .groupby("matchID")
+        .agg(**aggregations)
     )
-    pct_players_with_headshots.columns = ["pct_players_with_headshots"]
-
-    # concatenate all columns (features), along matchID index
-    df = pd.concat(
-        [
-            df_core,
-            df_detailed,
-            pct_players_0_kills,
-            pct_players_5_kills,
-            pct_players_10_kills,
-            pct_players_with_streak_5,
-            pct_players_with_double,
-            pct_players_with_headshots,
-        ],
-        axis=1,
-    ).reset_index()
+    df[pct_columns] = df[pct_columns].div(df.pop("n_players"), axis=0) * 100
 
-    return df
+    return df.reset_index()
 
 
-@st.cache(show_spinner=False)
 def pipeline_transform(last_session: List[Dict]):
     """
     Apply all above functions to get our data ready for prediction
@@ -393,7 +489,6 @@ def pipeline_transform(last_session: List[Dict]):
     return df
 
 
-@st.cache
 def predict_lobby_kd(df):
     """
     Apply XGBoost Model to predict average lobby kd, from match stats
@@ -408,8 +503,7 @@ def predict_lobby_kd(df):
         ["matchID", "utcEndSeconds"], axis=1
     )
     # predict game(s) lobby kd
-    model = xgb.XGBRegressor()
-    model.load_model("src/model/xgb_model_lobby_kd_2.json")
+    model = get_registry().get("lobby_kd")
     prediction = model.predict(df_features)  # array
 
     # append back predictions to matchID & utcEndSeconds
@@ -419,3 +513,48 @@ def predict_lobby_kd(df):
     df_with_kd.sort_values(by="utcEndSeconds", ascending=False, inplace=True)
 
     return df_with_kd
+
+
+def lobby_kd(last_session: List[Dict], store=None):
+    """
+    predict_lobby_kd(pipeline_transform(last_session)), through a store of predictions (cache.LobbyKdStore) :
+    matches already predicted by the current model version (for any player of the lobby, at a previous rerun)
+    are neither transformed nor predicted again
+
+    Returns:
+    --------
+    DataFrame, same as predict_lobby_kd()
+    matchID | utcEndSeconds | lobbyKd
+    """
+    if store is None:
+        return predict_lobby_kd(pipeline_transform(last_session))
+
+    version = get_registry().version()
+    end_times = {player["matchID"]: player["utcEndSeconds"] for player in last_session}
+    predictions = store.get(end_times, version)
+    missing = [
+        player for player in last_session if str(player["matchID"]) not in predictions
+    ]
+    if missing:
+        predicted = predict_lobby_kd(pipeline_transform(missing))
+        new = {
+            str(match_id): (end_times[match_id], lobby_kd)
+            for match_id, lobby_kd in zip(predicted["matchID"], predicted["lobbyKd"])
+        }
+        store.add(version, new)
+        predictions.update(new)
+
+    # as predict_lobby_kd() : matches in pipeline_transform order (sorted ids), then most recent first
+    match_ids = sorted(end_times)
+    df_with_kd = pd.DataFrame(
+        {
+            "matchID": match_ids,
+            "utcEndSeconds": pd.Series(
+                [end_times[match_id] for match_id in match_ids]
+            ).apply(lambda x: datetime.fromtimestamp(x)),
+            "lobbyKd": [predictions[str(match_id)][1] for match_id in match_ids],
+        }
+    )
+    df_with_kd.sort_values(by="utcEndSeconds", ascending=False, inplace=True)
+
+    return df_with_kd
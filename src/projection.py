@@ -0,0 +1,71 @@
+import hashlib
+import json
+
+"""
+Inside
+-----
+Declarative projection of COD API responses : keep only the fields the app reads, drop the rest
+
+- A match (GetMatch) returns dozens of fields per player (XP breakdowns, awards, full loadouts with perks
+  and attachments...), for +- 150 players. Only a few of them reach the session aggregations, the display
+  or the lobby kd model
+- Fields to keep are dotted paths declared in conf.toml [API_PROJECTION.<endpoint>], e.g.
+  "playerStats.kills", "player.loadout.*.primaryWeapon.name" ("*" : every key of a dict / item of a list)
+- Applied by EnhancedApi as responses arrive, so cached and in-memory payloads hold the projected fields only
+"""
+
+
+def _compile(paths):
+    """--> dict, tree of keys to keep, e.g. {"player": {"awards": {"double": None}}} ; None : keep whole value"""
+    tree = {}
+    for path in paths:
+        node = tree
+        keys = path.split(".")
+        for key in keys[:-1]:
+            # a shorter path already keeps the whole value
+            if key in node and node[key] is None:
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+    return tree
+
+
+def _project(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        subtree = tree.get("*", tree)
+        return [_project(item, subtree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "*" in tree:
+        return {key: _project(item, tree["*"]) for key, item in value.items()}
+    # keep the response keys order (first seen keys are first columns once flattened)
+    return {
+        key: _project(item, tree[key]) for key, item in value.items() if key in tree
+    }
+
+
+class Projection:
+    """Keep only some fields (dotted paths) of an API response ; missing fields stay missing"""
+
+    def __init__(self, paths):
+        self.paths = sorted(set(paths))
+        self.tree = _compile(self.paths)
+        # identifies the projection, e.g. in cache keys : a response stored with other fields is not served
+        digest = hashlib.sha1(json.dumps(self.paths).encode()).hexdigest()
+        self.fingerprint = digest[:10]
+
+    @classmethod
+    def from_conf(cls, CONF, endpoint="match"):
+        """--> Projection, or None if disabled (or no fields declared) in conf.toml [API_PROJECTION]"""
+        conf_projection = CONF.get("API_PROJECTION", {})
+        paths = conf_projection.get(endpoint)
+        if not conf_projection.get("enabled", False) or not paths:
+            return None
+        return cls(paths)
+
+    def apply(self, response):
+        """--> response (list / dict, as returned by the API) with declared fields only"""
+        return _project(response, self.tree)
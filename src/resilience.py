@@ -0,0 +1,252 @@
+import asyncio
+import collections
+import contextvars
+import random
+import time
+
+import backoff
+import httpx
+
+from src.limits import is_throttled, retry_after
+
+"""
+Inside
+-----
+Keep the app responsive when COD API is slow
+
+- HedgePolicy : hedged requests. When a request has no reply after a (high) percentile of observed latencies,
+  send one duplicate, take whichever answers first and cancel the other. Capped by a budget (% of requests)
+  Latencies are timed from the HTTP send (see mark_sent()), not from the concurrency / rate limits queues
+- CircuitBreaker : shared by every request, trips after consecutive failures. While open, calls fail in
+  milliseconds (CircuitOpenError) and the app serves cached or offline data instead of hanging on retries
+- Retries (backoff lib) wait what the server asks (Retry-After), and give up at once on errors a retry won't fix
+"""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling COD API while the circuit breaker is open"""
+
+
+def is_permanent(exc):
+    """--> bool, an error retrying won't fix : 4xx client errors (except 429 Too Many Requests)
+
+    Meant as backoff `giveup` predicate ; transport errors (timeouts, connection...), 429 and 5xx are retried
+    """
+    return isinstance(exc, httpx.HTTPStatusError) and not is_throttled(exc)
+
+
+def is_unavailable(exc):
+    """--> bool, COD API is down or overloaded : circuit breaker open, transport error, 429 or 5xx
+
+    i.e. a cached or offline fallback makes sense, whereas a 4xx client error must be surfaced
+    """
+    return isinstance(exc, (CircuitOpenError, httpx.TransportError)) or is_throttled(
+        exc
+    )
+
+
+def retry_after_expo(base=2, factor=1, max_value=None):
+    """backoff wait generator : server Retry-After hint if any, else exponential delay with full jitter
+
+    Use with jitter=None in backoff.on_exception(), so a server hint is not jittered
+    """
+    expo = backoff.expo(base=base, factor=factor, max_value=max_value)
+    next(expo)  # initialize, as backoff does with its own wait generators
+    exc = yield
+    while True:
+        hint = retry_after(exc)
+        delay = random.uniform(0, next(expo))
+        exc = yield hint if hint is not None else delay
+
+
+class CircuitBreaker:
+    """Circuit breaker around COD API requests, used as an async context manager
+
+    - closed : requests go through. `failure_threshold` consecutive failures (transport errors, 429, 5xx)
+      open the circuit
+    - open : requests raise CircuitOpenError immediately, for `reset_timeout` seconds
+      (or longer if the server asked so with Retry-After)
+    - half-open : after that, a single trial request goes through : success closes, failure re-opens
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.open_until = None
+        self._trial_running = False
+
+        # metrics
+        self.trips = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_conf(cls, CONF):
+        """--> CircuitBreaker, settings from conf.toml [API_CIRCUIT_BREAKER]"""
+        return cls(**CONF.get("API_CIRCUIT_BREAKER", {}))
+
+    @property
+    def state(self):
+        if self.open_until is None:
+            return "closed"
+        if time.monotonic() < self.open_until:
+            return "open"
+        return "half-open"
+
+    async def __aenter__(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial_running):
+            self.rejected += 1
+            raise CircuitOpenError(
+                f"COD API circuit breaker is open (after {self.failures} consecutive failures)"
+            )
+        if state == "half-open":
+            self._trial_running = True
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._trial_running = False
+        if exc is None:
+            self.failures = 0
+            self.open_until = None
+        elif isinstance(exc, httpx.TransportError) or is_throttled(exc):
+            self.failures += 1
+            # trip (again, if half-open trial failed) ; failures while already open just extend it
+            if self.failures >= self.failure_threshold or self.open_until is not None:
+                if self.state != "open":
+                    self.trips += 1
+                self.open_until = time.monotonic() + max(
+                    self.reset_timeout, retry_after(exc) or 0
+                )
+        return False
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+# set by HedgePolicy for each of its attempts (a task, with its own context), called by mark_sent()
+request_sent = contextvars.ContextVar("request_sent", default=None)
+
+
+def mark_sent():
+    """To call when an HTTP request is actually sent (after limits / queues), times hedged requests from there"""
+    callback = request_sent.get()
+    if callback is not None:
+        callback()
+
+
+class HedgePolicy:
+    """Hedged requests to cut the latency tail, e.g. on match details (GetMatch, ~150 players each)
+
+    - hedge delay : `percentile` of the last `window` observed latencies, no hedging before `min_samples`
+    - hedges sent never exceed `budget` (fraction) of requests, i.e. at most a few % of extra upstream load
+    """
+
+    def __init__(self, percentile=95, budget=0.05, min_samples=20, window=200):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+
+        # metrics
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_conf(cls, CONF, endpoint="match"):
+        """--> HedgePolicy, or None if hedging is disabled in conf.toml [API_HEDGING.<endpoint>]"""
+        conf_hedging = dict(CONF.get("API_HEDGING", {}).get(endpoint, {}))
+        if not conf_hedging.pop("enabled", False):
+            return None
+        return cls(**conf_hedging)
+
+    def delay(self):
+        """--> float (seconds) or None, time to wait for a reply before sending a hedge"""
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        idx = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[idx]
+
+    def _within_budget(self):
+        return self.hedges < self.budget * self.requests
+
+    async def _attempt(self, coro_function, sent):
+        """--> result of coro_function(), `sent` future set to the monotonic time its HTTP request is sent"""
+        # attempts run as tasks, each with its own context : set for this attempt only
+        request_sent.set(lambda: sent.done() or sent.set_result(time.monotonic()))
+        return await coro_function()
+
+    async def run(self, coro_function):
+        """--> result of the first successful of coro_function() calls (1 or 2 if hedged)
+
+        coro_function must call mark_sent() when its request leaves (i.e. once queues are passed, see
+        EnhancedApi._fetch) : the hedge delay runs from there
+        """
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        sent = [loop.create_future()]
+        tasks = [asyncio.ensure_future(self._attempt(coro_function, sent[0]))]
+
+        try:
+            delay = self.delay()
+            if delay is not None:
+                # waiting in the queues is not latency : hedging would only add load
+                await asyncio.wait(
+                    [tasks[0], sent[0]], return_when=asyncio.FIRST_COMPLETED
+                )
+                if not tasks[0].done():
+                    done, _ = await asyncio.wait(tasks, timeout=delay)
+                    if not done and self._within_budget():
+                        self.hedges += 1
+                        sent.append(loop.create_future())
+                        tasks.append(
+                            asyncio.ensure_future(self._attempt(coro_function, sent[1]))
+                        )
+
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    break
+                if not pending:
+                    # every attempt failed : raise the first request's error
+                    return tasks[0].result()
+
+            winner = winners[0]
+            winner_sent = sent[tasks.index(winner)]
+            if winner_sent.done():
+                self.latencies.append(time.monotonic() - winner_sent.result())
+            if winner is not tasks[0]:
+                self.hedge_wins += 1
+            return winner.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for future in sent:
+                future.cancel()
+
+    def stats(self):
+        """--> dict, hedging metrics : extra load (hedges %) and how often the hedge answered first"""
+        delay = self.delay()
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedges_pct": round(self.hedges * 100 / self.requests, 1)
+            if self.requests
+            else 0,
+            "hedge_win_rate": round(self.hedge_wins * 100 / self.hedges, 1)
+            if self.hedges
+            else 0,
+            "hedge_delay": round(delay, 3) if delay is not None else None,
+        }
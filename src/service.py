@@ -0,0 +1,169 @@
+import asyncio
+import atexit
+import threading
+
+import httpx
+
+from src.cache import HistoryStore, KpiStore, LobbyKdStore, ResponseCache
+from src.enhance import EnhancedApi
+from src.limits import AdaptiveLimiter, RateLimiter
+from src.projection import Projection
+from src.resilience import CircuitBreaker, HedgePolicy
+
+try:
+    import h2  # noqa: F401, httpx optional dependency for HTTP/2
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+"""
+Inside
+-----
+A long-lived, process-wide API service, shared by every Streamlit session and rerun
+
+- Streamlit re-executes Home.py top to bottom at every interaction : an EnhancedApi and an httpx client
+  (connection pool, TLS handshakes) would otherwise be rebuilt each time
+- One EnhancedApi + one pooled keep-alive httpx.AsyncClient (HTTP/2 if h2 is installed), living on a
+  persistent event loop in a background thread
+- Pages submit their API calls to this loop instead ; the httpx client is injected by the service
+- Also holds the process-wide KPIs store (kd history) and lobby kd predictions store, next to the API cache
+"""
+
+
+class ApiService:
+    """Run EnhancedApi coroutine methods on a persistent background event loop, with a shared client
+
+    Usage, from any thread / event loop:
+        service = get_service(sso, CONF)
+        profile = await service.GetProfileCached(platform, username)
+    """
+
+    def __init__(self, sso, CONF):
+        self.api = EnhancedApi(
+            sso,
+            cache=ResponseCache.from_conf(CONF),
+            match_limiter=AdaptiveLimiter.from_conf(CONF, "match"),
+            rate_limiter=RateLimiter.from_conf(CONF),
+            history=HistoryStore.from_conf(CONF),
+            hedging=HedgePolicy.from_conf(CONF, "match"),
+            breaker=CircuitBreaker.from_conf(CONF),
+            match_projection=Projection.from_conf(CONF, "match"),
+        )
+        # kd history KPIs state per player & mode, see kd_history.to_history
+        self.kpis = KpiStore.from_conf(CONF)
+        # predicted lobby kd per match, see predict.lobby_kd
+        self.lobby_kd = LobbyKdStore.from_conf(CONF)
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="wzkd-api-loop", daemon=True
+        )
+        self._thread.start()
+
+        # the client (and its pool) must be created & used within the service loop
+        self.client = asyncio.run_coroutine_threadsafe(
+            self._open_client(CONF.get("API_CLIENT", {})), self.loop
+        ).result()
+
+    @staticmethod
+    async def _open_client(conf_client):
+        """--> httpx.AsyncClient, pooled keep-alive connections as set in conf.toml [API_CLIENT]"""
+
+        limits = httpx.Limits(
+            max_connections=conf_client.get("max_connections", 10),
+            max_keepalive_connections=conf_client.get("max_keepalive_connections", 5),
+            keepalive_expiry=conf_client.get("keepalive_expiry", 30),
+        )
+        return httpx.AsyncClient(
+            http2=conf_client.get("http2", True) and HTTP2_AVAILABLE,
+            limits=limits,
+            timeout=conf_client.get("timeout", 10),
+        )
+
+    def submit(self, method, *args, **kwargs):
+        """Schedule EnhancedApi.<method>(client, *args, **kwargs) on the service loop
+
+        Returns
+        -------
+        concurrent.futures.Future, can be waited on from any thread
+        """
+        coro = getattr(self.api, method)(self.client, *args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def call(self, method, *args, **kwargs):
+        """Awaitable version of submit(), from the caller's own event loop"""
+        return await asyncio.wrap_future(self.submit(method, *args, **kwargs))
+
+    async def stream(self, method, *args, **kwargs):
+        """Async iterator version of call(), for EnhancedApi async generator methods e.g. GetMatchListStream
+
+        Every item is computed on the service loop, then handed over to the caller's loop
+        """
+        agen = getattr(self.api, method)(self.client, *args, **kwargs)
+        try:
+            while True:
+                item = await asyncio.wrap_future(
+                    asyncio.run_coroutine_threadsafe(_anext(agen), self.loop)
+                )
+                if item is _EXHAUSTED:
+                    return
+                yield item
+        finally:
+            # consumer stopped early (or is done) : let the generator clean up (cancel pending requests)
+            asyncio.run_coroutine_threadsafe(agen.aclose(), self.loop)
+
+    def __getattr__(self, method):
+        """service.GetMatchList(platform, ids) <=> await call("GetMatchList", platform, ids)"""
+        api = self.__dict__.get("api")
+        if method.startswith("_") or not hasattr(api, method):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+    def stats(self):
+        """--> dict, rate limits queue wait, concurrency, single-flight, hedging & circuit breaker metrics,
+        e.g. to check if we are saturated
+        """
+        return {
+            "rate_limits": self.api.rate_limiter.stats(),
+            "match_concurrency": self.api.match_limiter.stats(),
+            "shared_calls": self.api.flights.shared,
+            "match_hedging": self.api.hedging.stats() if self.api.hedging else None,
+            "circuit_breaker": self.api.breaker.stats(),
+        }
+
+    def close(self):
+        """Close the client pool, then stop the loop"""
+        if not self.loop.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self.client.aclose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        for store in (self.api.cache, self.api.history, self.kpis, self.lobby_kd):
+            if store is not None:
+                store.close()
+
+
+_EXHAUSTED = object()
+
+
+async def _anext(agen):
+    """--> next item of an async generator, or _EXHAUSTED (StopAsyncIteration can't cross loops)"""
+    try:
+        return await agen.__anext__()
+    except StopAsyncIteration:
+        return _EXHAUSTED
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service(sso, CONF):
+    """--> ApiService, created once per process (module state survives Streamlit reruns)"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ApiService(sso, CONF)
+            atexit.register(_service.close)
+    return _service
@@ -12,75 +12,137 @@ Aggregate detailed stats for a session of matches, here our last matches (BR / R
 """
 
 
-def get_teammates(last_session_formatted, gamertag):
-    """Get list of teammates from your last session of BR matches"""
-    ids = last_session_formatted.query("username == @gamertag")["matchID"].tolist()
-    teams = last_session_formatted.query("username == @gamertag")["team"].tolist()
-    teammates = []
-    for id_, team in zip(ids, teams):
-        teammates.extend(
-            last_session_formatted.query("matchID == @id_ & team == @team")[
-                "username"
-            ].tolist()
-        )
-
-    return sorted(list(set(teammates)), key=str.lower)
-
-
-def team_aggregated_stats(last_session_formatted, teammates):
-    """last session > n battle royale / Resurgence matches > formatted => team agregated stats"""
-
-    aggregations = {
-        "mode": "count",
-        "kills": "sum",
-        "deaths": "sum",
-        "assists": "sum",
-        "damageDone": "mean",
-        "damageTaken": "mean",
-        "gulagStatus": lambda x: (x.eq("W").sum() / x.isin(["W", "L"]).sum())
-        if x.eq("W").sum() > 0  # -_-
-        else 0,
-    }
-
-    team_session = (
-        last_session_formatted.query("username in @teammates")
-        .groupby("username")
-        .agg(aggregations)
-        .rename(columns={"mode": "played"})
-        .reset_index()
+def team_rows(last_session_formatted, gamertag):
+    """--> DataFrame, rows of gamertag's teams : every player in gamertag's (matchID, team) pairs, frame order"""
+    keys = ["matchID", "team"]
+    pairs = pd.MultiIndex.from_frame(last_session_formatted[keys])
+    player_pairs = pairs[(last_session_formatted["username"] == gamertag).to_numpy()]
+    return last_session_formatted[pairs.isin(player_pairs)]
+
+
+def coplay_counts(team_session):
+    """--> dict, {teammate: matches played together}, alphabetical order (gamertag included)
+
+    team_session : team_rows(), gamertag's teams rows
+    """
+    coplay = team_session.groupby("username", observed=True)["matchID"].nunique()
+    teammates = sorted(coplay.index.tolist(), key=str.lower)
+    return {teammate: int(coplay[teammate]) for teammate in teammates}
+
+
+def get_teammates(last_session_formatted, gamertag, counts=False):
+    """Get list of teammates from your last session of BR matches
+
+    Session players are matched once on gamertag's (matchID, team) pairs (team_rows), instead of a query per match
+    counts : if True, return a dict {teammate: matches played together} (same order) instead
+    """
+    coplay = coplay_counts(team_rows(last_session_formatted, gamertag))
+
+    if counts:
+        return coplay
+    return list(coplay)
+
+
+def aggregated_stats(last_session_formatted, by="username", **extra):
+    """last session > n battle royale / Resurgence matches > formatted => stats aggregated by `by`, in one group by
+
+    Rows are players in a match : by="username" for players, by=["matchID", "team"] for squads...
+    played (rows count), kills / deaths / assists (sums), damage (means), gulag win ratio, kdRatio,
+    loadoutBest : loadout (1) of the row with the highest kd, looked up by index (keyed, whatever the order)
+    extra : more named aggregations, e.g. teamPlacement=("teamPlacement", "first")
+    """
+
+    gulag = last_session_formatted["gulagStatus"]
+    grouped = last_session_formatted.assign(
+        gulagWins=gulag.eq("W"), gulagPlayed=gulag.isin(["W", "L"])
+    ).groupby(by, observed=True)
+    stats = grouped.agg(
+        played=("mode", "count"),
+        bestRow=("kdRatio", "idxmax"),
+        kills=("kills", "sum"),
+        deaths=("deaths", "sum"),
+        assists=("assists", "sum"),
+        damageDone=("damageDone", "mean"),
+        damageTaken=("damageTaken", "mean"),
+        gulagWins=("gulagWins", "sum"),
+        gulagPlayed=("gulagPlayed", "sum"),
+        **extra,
+    )
+
+    stats.insert(
+        1,
+        "loadoutBest",
+        last_session_formatted.loc[stats.pop("bestRow"), "loadout_1"].to_numpy(),
+    )
+    wins, played = stats.pop("gulagWins"), stats.pop("gulagPlayed")
+    stats.insert(
+        len(stats.columns) - len(extra),
+        "gulagStatus",
+        (wins / played).where(wins > 0, 0),  # -_-
+    )
+    stats["kdRatio"] = stats.kills / stats.deaths
+
+    return stats.reset_index()
+
+
+def team_aggregated_stats(team_session, coplay):
+    """last session > n battle royale / Resurgence matches > formatted => team agregated stats
+
+    team_session : team_rows(), gamertag's teams rows, computed once and shared with coplay_counts()
+    coplay : coplay_counts(team_session) ; played is the number of matches played together,
+    and stats aggregate these matches only
+    """
+
+    team_session = aggregated_stats(team_session)
+    team_session["played"] = (
+        team_session["username"].astype(object).map(coplay).astype("int64")
     )
-    team_session["kdRatio"] = team_session.kills / team_session.deaths
     team_session.sort_values(
         by="username", key=lambda col: col.str.lower(), inplace=True
     )
 
-    def extract_best_loadout(last_session_formatted, teammates):
-        """Extract loadout (1) of the game with the highest kd"""
-        # prior, both last_session and teammates are sorted alphabetically by username
-        loadout_idx = [
-            last_session_formatted.query("@user in username")["kdRatio"].idxmax()
-            for user in teammates
-        ]
-        return [
-            last_session_formatted.iloc[loadout_i]["loadout_1"]
-            for loadout_i in loadout_idx
-        ]
-
     def gulag_format(gulag_value):
         return str(int(gulag_value * 100)) + " %"
 
     def remove_session_teammates(team_session):
-        """Remove some of random people you played with"""
-        return team_session.sort_values(by="played", ascending=False).head(4)
+        """Remove some of random people you played with (ties : alphabetical order)"""
+        return team_session.sort_values(
+            by="played", ascending=False, kind="stable"
+        ).head(4)
 
-    best_loadout = extract_best_loadout(last_session_formatted, teammates)
-    team_session.insert(2, "loadoutBest", best_loadout)
     team_session.gulagStatus = team_session.gulagStatus.apply(gulag_format)
     team_session = remove_session_teammates(team_session)
 
     return team_session
 
 
+def squads_aggregated_stats(last_session_formatted):
+    """last session > n battle royale / Resurgence matches > formatted => every squad (team of a match) stats,
+    whole lobbies : last match first, best placed first
+    """
+
+    squads = aggregated_stats(
+        last_session_formatted,
+        by=["matchID", "team"],
+        utcEndSeconds=("utcEndSeconds", "first"),
+        teamPlacement=("teamPlacement", "min"),
+        players=(
+            "username",
+            lambda usernames: " | ".join(sorted(usernames, key=str.lower)),
+        ),
+    ).rename(columns={"played": "size"})
+
+    first_cols = ["matchID", "utcEndSeconds", "team", "teamPlacement", "players"]
+    squads = squads[first_cols + squads.columns.drop(first_cols).tolist()]
+    # last match first ; ties (same end time / placement) by matchID, team : categories are sorted alphabetically
+    return squads.sort_values(
+        by=["utcEndSeconds", "matchID", "teamPlacement", "team"],
+        ascending=[False, True, True, True],
+        kind="stable",
+        ignore_index=True,
+    )
+
+
 def get_players_weapons(last_session_formatted):
     """Compute overall session weapons stats for Loadout 1, all players, all session' matches"""
 
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -8,15 +9,186 @@ Shape our matches stats history as a session(s) history with aggregated stats pe
 
 - Before that, ou API output (matches history) was already converted to a df, flattened and formated to be readable / operable (using api_format module)
 - We define a session as one or several consecutive matches when idle time between two consecutives match is > 1 hour
+  (gap set in conf.toml [APP_BEHAVIOR] session_gap)
+- SessionIndex : sessions computed once over matches end times, read by every consumer (last session ids & type,
+  sessions history), updated as new pages of matches arrive
 - Perform data aggregations per session
 - The transformed data will then be displayed in Streamlit where we will eventually apply our rendering tweaks
 """
 
 
-def add_sessions(df):
-    """Add a col "session" with incremental number when duration between 2 games exceed 1 hour"""
+def mode_type(mode):
+    """--> str, "br" or "resurgence", None if not a Battle Royale / Resurgence API mode"""
+    if not isinstance(mode, str) or ("br_br" not in mode and "br_rebirth" not in mode):
+        return None
+    return "resurgence" if "rebirth" in mode else "br"
 
-    df["session"] = (df["utcEndSeconds"].diff().dt.total_seconds() < -3600).cumsum() + 1
+
+class SessionIndex:
+    """Play sessions of a matches history, most recent first : session 1 is the last one played
+
+    A new session starts when more than `gap` seconds separate the end of 2 consecutive matches
+    Matches are added by pages (update) : only the new matches and their junction with the known ones are
+    compared, unless a page overlaps the known history in time (then the index is rebuilt, in end time order)
+    """
+
+    def __init__(self, gap=3600):
+        self.gap = gap
+        # one entry per match, most recent first
+        self.end_times = np.empty(0, dtype="int64")
+        self.modes = np.empty(0, dtype=object)
+        self.match_ids = np.empty(0, dtype=object)
+        self.types = np.empty(0, dtype=object)
+        # True where a session starts
+        self._starts = np.empty(0, dtype=bool)
+        self._positions = {}
+
+    def clear(self):
+        """Forget every match (same gap), e.g. before indexing another history --> self"""
+        self.__init__(gap=self.gap)
+        return self
+
+    @classmethod
+    def from_conf(cls, CONF):
+        """--> SessionIndex, gap (seconds) from conf.toml [APP_BEHAVIOR] session_gap"""
+        return cls(gap=CONF.get("APP_BEHAVIOR", {}).get("session_gap", 3600))
+
+    def _breaks(self, end_times, previous=None):
+        """--> np.array(bool), True where a match starts a session (previous : end time of the match before)"""
+        if previous is None:
+            return np.concatenate(([True], np.diff(end_times) < -self.gap))
+        return np.diff(end_times, prepend=previous) < -self.gap
+
+    def add(self, end_times, modes, match_ids):
+        """Add matches, any order, already known match ids are skipped --> self
+
+        Parameters
+        ----------
+        end_times : array-like of int, matches end (epoch seconds)
+        modes : array-like of str, API modes
+        match_ids : array-like, matches ids
+        """
+        match_ids = np.array([str(match_id) for match_id in match_ids], dtype=object)
+        new = np.array([match_id not in self._positions for match_id in match_ids])
+        if not new.any():
+            return self
+        added = {
+            "end_times": np.asarray(end_times, dtype="int64")[new],
+            "modes": np.asarray(modes, dtype=object)[new],
+            "match_ids": match_ids[new],
+        }
+        added["types"] = np.array(
+            [mode_type(mode) for mode in added["modes"]], dtype=object
+        )
+        # most recent first (stable : API order for matches ended at the same time)
+        order = np.argsort(-added["end_times"], kind="stable")
+        added = {field: values[order] for field, values in added.items()}
+        known = {field: getattr(self, field) for field in added}
+        end_times = added["end_times"]
+
+        if not len(self.end_times) or end_times[0] <= self.end_times[-1]:
+            # older matches (next pages of history) : compared to the oldest known one only
+            previous = self.end_times[-1] if len(self.end_times) else None
+            merged = {field: (known[field], added[field]) for field in added}
+            starts = np.concatenate((self._starts, self._breaks(end_times, previous)))
+        elif end_times[-1] >= self.end_times[0]:
+            # newer matches (refresh) : only the junction with the most recent known match changes
+            merged = {field: (added[field], known[field]) for field in added}
+            junction = self._breaks(self.end_times[:1], end_times[-1])
+            starts = np.concatenate(
+                (self._breaks(end_times), junction, self._starts[1:])
+            )
+        else:
+            # pages overlapping the known history : rebuild
+            merged = {field: (known[field], added[field]) for field in added}
+            order = np.argsort(-np.concatenate(merged["end_times"]), kind="stable")
+            merged = {
+                field: (np.concatenate(values)[order],)
+                for field, values in merged.items()
+            }
+            starts = self._breaks(merged["end_times"][0])
+
+        for field, values in merged.items():
+            setattr(self, field, np.concatenate(values))
+        self._starts = starts
+        self._positions = {match_id: idx for idx, match_id in enumerate(self.match_ids)}
+        return self
+
+    def update(self, matches):
+        """Add recent matches API entries (list of dict), e.g. a new page of history --> self"""
+        return self.add(
+            [match["utcEndSeconds"] for match in matches],
+            [match["mode"] for match in matches],
+            [match["matchID"] for match in matches],
+        )
+
+    def add_frame(self, df):
+        """Add the matches of a formatted matches DataFrame (utcEndSeconds as naive local datetimes) --> self"""
+        # as epoch seconds, durations between matches are the same
+        end_times = df["utcEndSeconds"].to_numpy(dtype="datetime64[s]").astype("int64")
+        return self.add(end_times, df["mode"], df["matchID"])
+
+    @property
+    def session_ids(self):
+        """--> np.array(int), session of every match (1 : most recent session)"""
+        return np.cumsum(self._starts)
+
+    @property
+    def boundaries(self):
+        """--> list of (start, stop) positions of every session's matches, most recent session first"""
+        starts = np.flatnonzero(self._starts)
+        stops = np.append(starts[1:], len(self._starts))
+        return list(zip(starts.tolist(), stops.tolist()))
+
+    @property
+    def sessions_match_ids(self):
+        """--> list(list(str)), match ids of every session, most recent first"""
+        return [self.match_ids[start:stop].tolist() for start, stop in self.boundaries]
+
+    @property
+    def sessions_types(self):
+        """--> list(str), type ("br", "resurgence" or None) of every session, its most recent BR / Resurgence match"""
+        return [
+            next((type_ for type_ in self.types[start:stop] if type_), None)
+            for start, stop in self.boundaries
+        ]
+
+    def session_of(self, match_ids):
+        """--> np.array(int), session of every match id (0 : unknown match)"""
+        session_ids = self.session_ids
+        positions = (self._positions.get(str(match_id)) for match_id in match_ids)
+        return np.array(
+            [session_ids[pos] if pos is not None else 0 for pos in positions],
+            dtype="int64",
+        )
+
+    def _last_typed(self):
+        typed = np.flatnonzero(self.types != None)  # noqa: E711, element-wise
+        if not len(typed):
+            raise IndexError("No Battle Royale / Resurgence match in history")
+        return typed[0]
+
+    def last_session_type(self):
+        """--> str, "br" or "resurgence", type of the last BR / Resurgence match played"""
+        return self.types[self._last_typed()]
+
+    def last_session_ids(self):
+        """--> list(int), match ids of the last session of BR / Resurgence matches, of its last type played"""
+        last = self._last_typed()
+        session_ids = self.session_ids
+        selected = (session_ids == session_ids[last]) & (self.types == self.types[last])
+        return [int(match_id) for match_id in self.match_ids[selected]]
+
+
+def add_sessions(df, sessions=None):
+    """Add a col "session" with incremental number when duration between 2 games exceed 1 hour
+
+    sessions : SessionIndex of these matches, computed from df if not provided
+    """
+
+    if sessions is None:
+        sessions = SessionIndex().add_frame(df)
+    df["session"] = sessions.session_of(df["matchID"])
     return df
 
 
@@ -33,9 +205,11 @@ def to_core(df, CONF):
     return df[keep_cols]
 
 
-def to_history(df, CONF, LABELS):
+def to_history(df, CONF, LABELS, sessions=None):
     """Pipe the functions above to get our desired sessions history"""
-    df = df.pipe(add_sessions).pipe(to_core, CONF)
+    if sessions is None:
+        sessions = SessionIndex.from_conf(CONF).add_frame(df)
+    df = df.pipe(add_sessions, sessions).pipe(to_core, CONF)
 
     return df
 
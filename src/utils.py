@@ -3,10 +3,13 @@ import datetime
 from datetime import datetime, timezone
 
 from typing import Literal
+import numpy as np
 import pandas as pd
 import toml
 import json
 
+from src.sessions_history import SessionIndex
+
 # CONF utils
 
 
@@ -52,54 +55,61 @@ def filter_history(
     return recent_matches.query("mode in @list_modes")
 
 
-def get_last_session_ids(matches):
-    """Extract match ids, from last session matches, out of a single (last played) match type (br OR resu)"""
+# history partitions : {label: LABELS["modes"] group}
+HISTORY_PARTITIONS = {
+    "Battle Royale": "battle_royale",
+    "Resurgence": "resurgence",
+    "Others": "others",
+}
 
-    # Add a col "session" with incremental number when duration between 2 games exceed 1 hour
-    df_matches = pd.DataFrame(matches)[["utcEndSeconds", "mode", "matchID"]]
-    df_matches["utcEndSeconds"] = df_matches["utcEndSeconds"].apply(
-        lambda x: datetime.fromtimestamp(x)
-    )
-    df_matches["session"] = (
-        df_matches["utcEndSeconds"].diff().dt.total_seconds() < -3600
-    ).cumsum() + 1
 
-    df_matches = df_matches.query(
-        "`mode`.str.contains('br_br') or `mode`.str.contains('br_rebirth')"
-    )
-    session_min_idx = df_matches.session.min()
-    last_type_selector = df_matches["mode"].tolist()[0]
-    last_type_selector = (
-        "br_br" if not "rebirth" in last_type_selector else "br_rebirth"
-    )
-    match_ids = (
-        df_matches.query("`mode`.str.contains(@last_type_selector)")
-        .groupby("session")
-        .get_group(session_min_idx)
-        .matchID.tolist()
+def partition_history(recent_matches, LABELS):
+    """Split an (already parsed/formated) recent matches history into BR, Resurgence and Others matches at once
+
+    Every distinct mode is given its partition code once, rows are then split on codes
+
+    Returns
+    -------
+    dict, {"Battle Royale": DataFrame, "Resurgence": DataFrame, "Others": DataFrame}, as filter_history() would
+    """
+
+    labels = list(HISTORY_PARTITIONS)
+    mode_codes = {
+        mode: code
+        for code, label in enumerate(labels)
+        for mode in LABELS.get("modes").get(HISTORY_PARTITIONS[label]).values()
+    }
+    modes = recent_matches["mode"].astype("category")
+    # trailing -1 : missing mode (category code -1)
+    category_codes = np.array(
+        [mode_codes.get(mode, -1) for mode in modes.cat.categories] + [-1]
     )
-    return [int(br_id) for br_id in match_ids]
+    codes = category_codes[modes.cat.codes.to_numpy()]
 
+    return {label: recent_matches[codes == code] for code, label in enumerate(labels)}
 
-def get_last_session_type(matches):
+
+def get_last_session_ids(matches, gap=3600):
+    """Extract match ids, from last session matches, out of a single (last played) match type (br OR resu)
+
+    Prefer sessions_history.SessionIndex if sessions are needed more than once
+    """
+
+    return SessionIndex(gap).update(matches).last_session_ids()
+
+
+def get_last_session_type(matches, gap=3600):
     """Extract last match type played (br or resu), from last session matches"""
 
-    # Add a col "session" with incremental number when duration between 2 games exceed 1 hour
-    df_matches = pd.DataFrame(matches)[["utcEndSeconds", "mode", "matchID"]]
-    df_matches["utcEndSeconds"] = df_matches["utcEndSeconds"].apply(
-        lambda x: datetime.fromtimestamp(x)
-    )
-    df_matches["session"] = (
-        df_matches["utcEndSeconds"].diff().dt.total_seconds() < -3600
-    ).cumsum() + 1
+    return SessionIndex(gap).update(matches).last_session_type()
 
-    df_matches = df_matches.query(
-        "`mode`.str.contains('br_br') or `mode`.str.contains('br_rebirth')"
-    )
-    session_min_idx = df_matches.session.min()
-    last_type_selector = df_matches["mode"].tolist()[0]
-    last_type_selector = "br" if not "rebirth" in last_type_selector else "resurgence"
-    return last_type_selector
+
+def split_matches(players):
+    """--> list(list(dict)), players stats of several matches (GetMatch results, concatenated) split by match"""
+    matches = {}
+    for player in players:
+        matches.setdefault(player["matchID"], []).append(player)
+    return list(matches.values())
 
 
 def get_gamertag(matches):
@@ -142,7 +152,7 @@ def get_mode(df):
 
 def concat_cols(df, to_concat, sep):
     check = to_concat[0]
-    if df[check].dtypes == "float64":
+    if pd.api.types.is_float_dtype(df[check]):
         return df[to_concat].astype(int).astype(str).T.agg(sep.join)
     else:
         return df[to_concat].astype(str).T.agg(sep.join)
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import pickle
+import time
+
+import httpx
+import pandas as pd
+import pytest
+
+from src import api_format, limits, resilience
+from src.utils import get_gamertag, load_conf, load_labels
+
+"""
+Inside
+-----
+Shared by the tests : bundled samples (saved API responses, data/*.pkl), conf & labels, formatted frames,
+frozen former outputs (tests/data/former_formatted.pkl, computed in UTC by the baseline api_format & kd_history),
+a timing helper for the benchmarks (run with -s to print their timings), a UTC local timezone fixture,
+a fake monotonic clock fixture and API errors for the client-side limits & circuit breaker
+
+    python -m pytest tests -s
+"""
+
+CONF = load_conf()
+LABELS = load_labels()
+SAMPLES = {
+    "last_session": "data/sample_last_session.pkl",
+    "recent_matches": "data/sample_recent_matches.pkl",
+}
+
+
+def load_sample(name):
+    """--> list(dict), saved API response : "last_session" or "recent_matches" """
+    with open(SAMPLES[name], "rb") as f:
+        return pickle.load(f)
+
+
+GAMERTAG = get_gamertag(load_sample("recent_matches"))
+
+
+def formatted(records):
+    """--> DataFrame, API result flattened, formatted, augmented (pandas : api_format)"""
+    df = api_format.res_to_df(records, CONF)
+    return api_format.augment_df(api_format.format_df(df, CONF, LABELS), LABELS)
+
+
+def load_former(name):
+    """--> dict of DataFrames, frozen former output : "formatted" or "kd_history" """
+    with open("tests/data/former_formatted.pkl", "rb") as f:
+        return pickle.load(f)[name]
+
+
+def assert_same_values(df, expected):
+    """Same columns & values as a frozen former frame, whatever the dtypes (compact ints, categoricals...)"""
+    assert sorted(df.columns) == sorted(expected.columns)
+    for col in expected.columns:
+        values = df[col].reset_index(drop=True)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        pd.testing.assert_series_equal(
+            values,
+            expected[col].reset_index(drop=True),
+            check_dtype=False,
+            check_exact=True,
+        )
+
+
+def best_time(func, *args, repeat=5):
+    """--> float, seconds, best of `repeat` runs"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@pytest.fixture
+def utc():
+    """local timezone set to UTC for the test (timestamps are formatted as local datetimes)"""
+    former = os.environ.get("TZ")
+    os.environ["TZ"] = "UTC"
+    time.tzset()
+    yield
+    if former is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = former
+    time.tzset()
+
+
+def status_error(status, retry_after=None):
+    """--> httpx.HTTPStatusError, as EnhancedApi._fetch raises it on a non 2xx response"""
+    request = httpx.Request("GET", "https://my.callofduty.com/api/papi-client/")
+    headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"{status}", request=request, response=response)
+
+
+async def settle():
+    """let every ready task run until it blocks"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class FakeClock:
+    """Monotonic clock that only moves when told to, or when src.limits sleeps"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self._sleep = asyncio.sleep
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    async def sleep(self, seconds):
+        # other ready tasks run first, at the current time
+        await self._sleep(0)
+        self.now += max(0.0, seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """fake monotonic clock for src.limits & src.resilience time.monotonic(), and for asyncio.sleep() during the test
+    (TokenBucket waits for its tokens with it) : no real waits, deterministic timings"""
+    fake = FakeClock()
+    monkeypatch.setattr(limits, "time", fake)
+    monkeypatch.setattr(resilience, "time", fake)
+    monkeypatch.setattr(limits.asyncio, "sleep", fake.sleep)
+    return fake
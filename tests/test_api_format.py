@@ -0,0 +1,95 @@
+import pandas as pd
+
+from src import api_format
+from tests.conftest import (
+    CONF,
+    SAMPLES,
+    assert_same_values,
+    best_time,
+    formatted,
+    load_former,
+    load_sample,
+)
+
+"""
+Inside
+-----
+api_format.flatten_records (single pass over the records) vs the former res_to_df (nested .apply(pd.Series)),
+on the bundled pickles : same frame, and how much faster
+res_to_df -> format_df -> augment_df with compact dtypes : same values as the former (frozen) output
+"""
+
+
+def former_res_to_df(res, CONF):
+    """res_to_df before flatten_records (without compact dtypes), frozen as the reference"""
+
+    def extract_loadouts(df):
+        loadout_col = "loadout" if "loadout" in df.columns.tolist() else "loadouts"
+        df_loadouts = df[loadout_col].apply(pd.Series)
+        n_loadouts = min(
+            CONF.get("API_OUTPUT_FORMAT")["n_loadouts"], len(df_loadouts.columns)
+        )
+        df_loadouts = df_loadouts.iloc[:, 0:n_loadouts]
+        return df_loadouts.rename(
+            columns={idx: f"loadout_{idx+1}" for idx in df_loadouts.columns}
+        )
+
+    def extract_missions(df):
+        df_missions = df["brMissionStats"].apply(pd.Series)
+        return pd.concat(
+            [
+                df_missions.drop(["missionStatsByType"], axis=1),
+                df_missions["missionStatsByType"].apply(pd.Series),
+            ],
+            axis=1,
+        )
+
+    df = pd.DataFrame(res)
+    df = pd.concat(
+        [df.drop(["playerStats"], axis=1), df["playerStats"].apply(pd.Series)], axis=1
+    )
+    df = pd.concat([df.drop(["player"], axis=1), df["player"].apply(pd.Series)], axis=1)
+    loadout_cols = [col for col in df.columns if col.startswith("loado")]
+    df = pd.concat([df.drop(loadout_cols, axis=1), extract_loadouts(df)], axis=1)
+    if "brMissionStats" in df.columns.tolist():
+        df = pd.concat(
+            [df.drop(["brMissionStats"], axis=1), extract_missions(df)], axis=1
+        )
+    df.dropna(axis=1, how="all", inplace=True)
+    return df.loc[:, ~df.columns.duplicated()]
+
+
+def flatten(res):
+    n_loadouts = CONF.get("API_OUTPUT_FORMAT")["n_loadouts"]
+    return pd.DataFrame(
+        api_format.flatten_records(res, n_loadouts), index=range(len(res))
+    )
+
+
+def test_flatten_records_parity():
+    for name in SAMPLES:
+        res = load_sample(name)
+        pd.testing.assert_frame_equal(flatten(res), former_res_to_df(res, CONF))
+
+
+def test_flatten_records_benchmark():
+    res = load_sample("last_session")
+    for copies in (1, 6):
+        records = res * copies
+        former = best_time(former_res_to_df, records, CONF)
+        single_pass = best_time(flatten, records)
+        print(
+            f"\n{len(records)} rows : former {former * 1000:.1f} ms, "
+            f"flatten_records {single_pass * 1000:.1f} ms ({former / single_pass:.0f}x)"
+        )
+        # x20+ measured : a wide margin against noisy machines
+        assert single_pass * 3 < former
+
+
+def test_formatted_former_values(utc):
+    expected = load_former("formatted")
+    for name in SAMPLES:
+        df = formatted(load_sample(name))
+        assert_same_values(df, expected[name])
+        # counters at least int32 (int16 arithmetic overflows), ratios not downcast
+        assert not any(dtype in ("int8", "int16", "float32") for dtype in df.dtypes)
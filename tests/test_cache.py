@@ -0,0 +1,106 @@
+import asyncio
+
+from src.cache import SingleFlight
+from tests.conftest import settle
+
+"""
+Inside
+-----
+cache.SingleFlight : concurrent calls of a key share a single call, which a cancelled caller does not cancel for
+the others, which is cancelled once nobody awaits it anymore, and whose error every caller sees
+"""
+
+
+class Fetch:
+    """Coroutine function standing for an API request : runs until released, records its calls & cancellations"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return f"response {call}"
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        flights, fetch = SingleFlight(), Fetch()
+        first = asyncio.ensure_future(flights.do("match", fetch))
+        second = asyncio.ensure_future(flights.do("match", fetch))
+        await settle()
+
+        first.cancel()
+        await settle()
+        assert first.cancelled()
+        assert fetch.cancelled == 0
+
+        fetch.release.set()
+        assert await second == "response 1"
+        assert (fetch.calls, flights.shared) == (1, 1)
+
+        # the call is done : the key is free, a new call is sent
+        assert await flights.do("match", fetch) == "response 2"
+
+    asyncio.run(main())
+
+
+def test_call_cancelled_once_every_caller_is():
+    async def main():
+        flights, fetch = SingleFlight(), Fetch()
+        callers = [asyncio.ensure_future(flights.do("match", fetch)) for _ in range(3)]
+        await settle()
+
+        for caller in callers:
+            caller.cancel()
+        await settle()
+        assert all(caller.cancelled() for caller in callers)
+        assert (fetch.calls, fetch.cancelled) == (1, 1)
+
+        # the cancelled call is not shared with later callers
+        fetch.release.set()
+        assert await flights.do("match", fetch) == "response 2"
+
+    asyncio.run(main())
+
+
+def test_error_seen_by_every_caller():
+    async def main():
+        flights, fetch = SingleFlight(), Fetch(error=ValueError("503"))
+        callers = [asyncio.ensure_future(flights.do("match", fetch)) for _ in range(3)]
+        await settle()
+
+        fetch.release.set()
+        errors = await asyncio.gather(*callers, return_exceptions=True)
+        assert fetch.calls == 1
+        assert all(error is fetch.error for error in errors)
+
+    asyncio.run(main())
+
+
+def test_keys_are_not_shared():
+    async def main():
+        flights, fetch = SingleFlight(), Fetch()
+        callers = [
+            asyncio.ensure_future(flights.do(key, fetch)) for key in ("a", "b", "a")
+        ]
+        await settle()
+        fetch.release.set()
+        assert sorted(await asyncio.gather(*callers)) == [
+            "response 1",
+            "response 1",
+            "response 2",
+        ]
+        assert flights.shared == 1
+
+    asyncio.run(main())
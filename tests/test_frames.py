@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+from src import frames
+from tests.conftest import CONF, GAMERTAG, LABELS, best_time, load_sample
+
+"""
+Inside
+-----
+PandasFrames vs PolarsFrames, step by step on the bundled pickles (x1, and x6 for ties and volume) :
+every step gives the same frame, and the timings of each backend
+"""
+
+pytest.importorskip("polars")
+
+BACKENDS = (frames.PandasFrames, frames.PolarsFrames)
+LAST_SESSION = load_sample("last_session")
+
+
+def run_steps(F, records):
+    """--> dict, output of each backend step, as pandas (or python) objects
+
+    copies : the pandas steps may modify their input frame in place
+    """
+    out = {}
+    df = F.res_to_df(records, CONF)
+    out["res_to_df"] = F.to_pandas(df).copy()
+    df = F.format_df(df, CONF, LABELS)
+    out["format_df"] = F.to_pandas(df).copy()
+    df = F.augment_df(df, LABELS)
+    out["augment_df"] = F.to_pandas(df).copy()
+    out["player_stats"] = F.to_pandas(F.player_stats(df, GAMERTAG))
+    out["get_teammates"] = F.get_teammates(df, GAMERTAG)
+    out["get_teammates_counts"] = F.get_teammates(df, GAMERTAG, counts=True)
+    team_session = F.team_rows(df, GAMERTAG)
+    out["team_rows"] = F.to_pandas(team_session).copy()
+    out["team_aggregated_stats"] = F.to_pandas(
+        F.team_aggregated_stats(team_session, F.coplay_counts(team_session))
+    )
+    out["squads_aggregated_stats"] = F.to_pandas(F.squads_aggregated_stats(df))
+    return out
+
+
+@pytest.mark.parametrize("copies", (1, 6))
+@pytest.mark.parametrize("sample", ("recent_matches", "last_session"))
+def test_backends_parity(sample, copies):
+    records = load_sample(sample)
+    expected = run_steps(frames.PandasFrames, records * copies)
+    result = run_steps(frames.PolarsFrames, records * copies)
+    for step, value in expected.items():
+        if isinstance(value, pd.DataFrame):
+            pd.testing.assert_frame_equal(
+                value.reset_index(drop=True),
+                result[step],
+                check_index_type=False,
+                obj=step,
+            )
+        else:
+            assert value == result[step], step
+
+
+def test_squads_tiebreak():
+    # same end time for every match : ordered by matchID, then placement, then team
+    records = [
+        {**record, "utcEndSeconds": LAST_SESSION[0]["utcEndSeconds"]}
+        for record in LAST_SESSION
+    ]
+    squads = [
+        run_steps(F, records)["squads_aggregated_stats"].reset_index(drop=True)
+        for F in BACKENDS
+    ]
+    pd.testing.assert_frame_equal(*squads, check_index_type=False)
+
+
+def test_backends_benchmark():
+    for copies in (1, 6):
+        records = LAST_SESSION * copies
+        timings = {F.name: best_time(run_steps, F, records) for F in BACKENDS}
+        print(
+            f"\n{len(records)} rows : "
+            + ", ".join(f"{name} {t * 1000:.1f} ms" for name, t in timings.items())
+        )
@@ -0,0 +1,32 @@
+from src import kd_history, utils
+from src.cache import KpiStore
+from tests.conftest import (
+    LABELS,
+    assert_same_values,
+    formatted,
+    load_former,
+    load_sample,
+)
+
+"""
+Inside
+-----
+kd history KPIs (cumulative kd, averages, moving averages, gulag win %) of the recent matches sample, per mode type :
+same values as the former (frozen) output, with compact dtypes, computed at once (to_history) or match after match
+from a KPIs store (resume_history)
+"""
+
+
+def test_kpis_former_values(utc, tmp_path):
+    partitions = utils.partition_history(
+        formatted(load_sample("recent_matches")), LABELS
+    )
+    store = KpiStore(str(tmp_path / "kpis.sqlite"))
+    for label, expected in load_former("kd_history").items():
+        columns = expected.columns.tolist()
+        history = kd_history.to_history(partitions[label].copy())
+        assert_same_values(history[columns], expected)
+        resumed = kd_history.to_history(
+            partitions[label].copy(), store=store, key=("battle", "u", label)
+        )
+        assert_same_values(resumed[columns], expected)
@@ -0,0 +1,231 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from src.limits import AdaptiveLimiter, RateLimiter, TokenBucket, retry_after
+from tests.conftest import settle, status_error
+
+"""
+Inside
+-----
+Client-side limits on a fake clock (conftest clock fixture) : AdaptiveLimiter AIMD limit (increase on successes,
+decrease on 429 / 5xx once per cooldown, Retry-After waited out), Retry-After parsing, TokenBucket refill and
+queue wait metrics, RateLimiter buckets per endpoint
+"""
+
+
+async def request(limiter, error=None):
+    """one request through the limiter, failing with `error` if any"""
+    async with limiter:
+        if error is not None:
+            raise error
+
+
+def test_increase_on_successes(clock):
+    async def main():
+        limiter = AdaptiveLimiter(initial=2, maximum=4)
+        for expected in (2.5, 2.9, 2.9 + 1 / 2.9):
+            await request(limiter)
+            assert limiter.limit == pytest.approx(expected)
+        for _ in range(20):
+            await request(limiter)
+        assert limiter.limit == 4
+
+    asyncio.run(main())
+
+
+def test_decrease_on_throttling(clock):
+    async def main():
+        limiter = AdaptiveLimiter(initial=8, minimum=1, decrease=0.5, cooldown=1.0)
+        with pytest.raises(httpx.HTTPStatusError):
+            await request(limiter, status_error(429))
+        assert limiter.limit == 4
+
+        # in-flight failures within the cooldown are the same congestion event
+        with pytest.raises(httpx.HTTPStatusError):
+            await request(limiter, status_error(503))
+        assert limiter.limit == 4
+
+        for status, expected in ((500, 2), (502, 1), (503, 1)):
+            clock.advance(1.5)
+            with pytest.raises(httpx.HTTPStatusError):
+                await request(limiter, status_error(status))
+            assert limiter.limit == expected
+
+        # client errors are not a "slow down" signal
+        clock.advance(1.5)
+        limiter.limit = 4.0
+        for error in (status_error(404), httpx.ConnectError("down")):
+            with pytest.raises(type(error)):
+                await request(limiter, error)
+        assert limiter.limit == 4
+
+    asyncio.run(main())
+
+
+def test_in_flight_limit(clock):
+    async def main():
+        limiter = AdaptiveLimiter(initial=2)
+        release = asyncio.Event()
+
+        async def slow_request():
+            async with limiter:
+                await release.wait()
+
+        tasks = [asyncio.ensure_future(slow_request()) for _ in range(3)]
+        await settle()
+        assert limiter.stats()["in_flight"] == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert limiter.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_retry_after_waited_out(clock):
+    async def main():
+        limiter = AdaptiveLimiter(initial=4)
+        release = asyncio.Event()
+        entered = []
+
+        async def slow_request():
+            async with limiter:
+                await release.wait()
+
+        async def next_request():
+            async with limiter:
+                entered.append(clock.monotonic())
+
+        running = asyncio.ensure_future(slow_request())
+        await settle()
+        with pytest.raises(httpx.HTTPStatusError):
+            await request(limiter, status_error(429, retry_after="2"))
+        assert limiter.stats()["blocked_for"] == 2
+
+        waiting = asyncio.ensure_future(next_request())
+        await settle()
+        assert entered == []
+
+        # requests resume once Retry-After is over, here woken up by the slow request's release
+        clock.advance(2)
+        release.set()
+        await asyncio.gather(running, waiting)
+        assert entered == [1002.0]
+        assert limiter.stats()["blocked_for"] == 0
+
+    asyncio.run(main())
+
+
+def test_retry_after():
+    assert retry_after(status_error(429, retry_after="3")) == 3
+    assert retry_after(status_error(503, retry_after="1.5")) == 1.5
+    assert retry_after(status_error(503, retry_after="-1")) == 0
+    assert retry_after(status_error(503, retry_after="soon")) is None
+    assert retry_after(status_error(503)) is None
+    assert retry_after(httpx.ConnectError("down")) is None
+
+    date = datetime.now(timezone.utc) + timedelta(seconds=120)
+    hint = retry_after(status_error(429, retry_after=format_datetime(date, True)))
+    assert 115 <= hint <= 120
+    past = datetime.now(timezone.utc) - timedelta(seconds=120)
+    assert retry_after(status_error(429, retry_after=format_datetime(past, True))) == 0
+
+
+def test_token_bucket_burst_then_rate(clock):
+    async def main():
+        bucket = TokenBucket(rate=2, burst=3)
+        for _ in range(3):
+            await bucket.acquire()
+        assert clock.monotonic() == 1000
+        assert bucket.stats()["waited_pct"] == 0
+
+        # bucket empty : next token in 1 / rate seconds
+        await bucket.acquire()
+        assert clock.monotonic() == 1000.5
+        assert bucket.stats() == {
+            "queued": 0,
+            "acquired": 4,
+            "waited_pct": 25.0,
+            "wait_avg": 0.125,
+            "wait_max": 0.5,
+            "tokens": 0,
+        }
+
+    asyncio.run(main())
+
+
+def test_token_bucket_refill(clock):
+    async def main():
+        bucket = TokenBucket(rate=2, burst=3)
+        for _ in range(3):
+            await bucket.acquire()
+
+        clock.advance(0.75)
+        await bucket.acquire()
+        assert bucket.stats()["tokens"] == 0.5
+        assert clock.monotonic() == 1000.75
+
+        # refill is capped at burst
+        clock.advance(60)
+        await bucket.acquire()
+        assert bucket.stats()["tokens"] == 2
+        assert bucket.stats()["waited_pct"] == 0
+
+    asyncio.run(main())
+
+
+def test_token_bucket_queue_wait(clock):
+    async def main():
+        bucket = TokenBucket(rate=1, burst=1)
+        acquired = []
+
+        async def request():
+            await bucket.acquire()
+            acquired.append(clock.monotonic())
+
+        tasks = [asyncio.ensure_future(request()) for _ in range(4)]
+        await settle()
+        assert bucket.stats()["queued"] > 0
+
+        # first-come first-served, one token per second : waits of 0, 1, 2, 3 seconds
+        await asyncio.gather(*tasks)
+        assert acquired == [1000, 1001, 1002, 1003]
+        assert bucket.stats() == {
+            "queued": 0,
+            "acquired": 4,
+            "waited_pct": 75.0,
+            "wait_avg": 1.5,
+            "wait_max": 3,
+            "tokens": 0,
+        }
+
+    asyncio.run(main())
+
+
+def test_rate_limiter(clock):
+    async def main():
+        rate_limiter = RateLimiter({"match": TokenBucket(rate=0.5, burst=1)})
+        for _ in range(10):
+            await rate_limiter.acquire("profile")
+        assert clock.monotonic() == 1000
+
+        await rate_limiter.acquire("match")
+        await rate_limiter.acquire("match")
+        assert clock.monotonic() == 1002
+        assert list(rate_limiter.stats()) == ["match"]
+        assert rate_limiter.stats()["match"]["wait_max"] == 2
+
+    asyncio.run(main())
+
+
+def test_rate_limiter_from_conf():
+    rate_limiter = RateLimiter.from_conf(
+        {"API_RATE_LIMITS": {"match": {"rate": 0.5, "burst": 10}}}
+    )
+    bucket = rate_limiter.buckets["match"]
+    assert (bucket.rate, bucket.burst, bucket.tokens) == (0.5, 10, 10)
+    assert RateLimiter.from_conf({}).buckets == {}
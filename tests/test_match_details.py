@@ -0,0 +1,50 @@
+import pytest
+
+from src import match_details
+from tests.conftest import GAMERTAG, LABELS, formatted, load_sample
+
+"""
+Inside
+-----
+match_details.lobby_analytics (every match of a frame, one grouped pass) vs the per-match functions
+(one lobby, filtered at each call), match after match of data/sample_last_session.pkl
+"""
+
+SESSION = formatted(load_sample("last_session"))
+LOBBIES = match_details.lobby_analytics(SESSION, GAMERTAG, LABELS)
+
+
+@pytest.mark.parametrize("match_id", SESSION["matchID"].unique().tolist())
+def test_lobby_analytics_parity(match_id):
+    lobby = SESSION[SESSION["matchID"] == match_id]
+    match = LOBBIES["matches"].loc[match_id]
+
+    assert match["teamPlacement"] == match_details.get_placement(lobby, GAMERTAG)
+    player = match_details.get_player_kills(lobby, GAMERTAG)
+    assert (match["kills"], match["deaths"]) == (player["kills"], player["deaths"])
+    assert match["kdRatio"] == player["kdRatio"]
+
+    team = match_details.teamKills(lobby, GAMERTAG, LABELS).iloc[-1]
+    assert (match["teamKills"], match["teamDeaths"]) == (team["kills"], team["deaths"])
+    assert round(match["teamKillsShare"], 1) == match_details.teamPercentageKills(
+        lobby, GAMERTAG
+    )
+    # teamKillsPlacement ranks tied teams in sort order, lobby_analytics gives them the best rank
+    team_kills = LOBBIES["teams"].loc[match_id, "kills"]
+    if (team_kills == match["teamKills"]).sum() == 1:
+        assert match["teamKillsRank"] == match_details.teamKillsPlacement(
+            lobby, GAMERTAG
+        )
+
+    top_players = LOBBIES["top_players"].loc[[match_id]]
+    assert (
+        top_players["kills"].tolist()
+        == match_details.topPlayers(lobby, LABELS)["kills"].tolist()
+    )
+
+    quartiles = match_details.playersQuartiles(lobby)
+    for col in ("kills", "kdRatio"):
+        for stat, value in quartiles[col].items():
+            assert LOBBIES["quartiles"].loc[match_id, (col, stat)] == pytest.approx(
+                value
+            )
@@ -0,0 +1,24 @@
+import pandas as pd
+
+from src import predict
+from tests.conftest import load_sample
+
+"""
+Inside
+-----
+predict.perform_aggregations (single group by) vs the former six passes implementation, on data/sample_last_session.pkl :
+the former result is frozen in tests/data/perform_aggregations_expected.pkl (computed in UTC, as datetime features
+depend on the local timezone)
+"""
+
+EXPECTED = "tests/data/perform_aggregations_expected.pkl"
+
+
+def test_perform_aggregations_parity(utc):
+    df = predict.to_model_format(load_sample("last_session"))
+    df = predict.select_features(df)
+    df = predict.encode_features(df)
+    df = predict.create_new_features(df)
+    pd.testing.assert_frame_equal(
+        predict.perform_aggregations(df), pd.read_pickle(EXPECTED), check_exact=True
+    )
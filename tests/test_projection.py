@@ -0,0 +1,53 @@
+import pandas as pd
+
+from src import match_details, predict, session_details, utils
+from src.projection import Projection
+from tests.conftest import CONF, GAMERTAG, LABELS, formatted, load_sample
+
+"""
+Inside
+-----
+conf.toml [API_PROJECTION] match paths vs what the app reads : every match of data/sample_last_session.pkl
+projected as EnhancedApi would (before caching), then formatted & aggregated, gives the same results as the whole
+payload. A field missing from the paths fails here instead of online, once projected payloads are cached
+"""
+
+
+def last_session_outputs(last_session):
+    """--> dict, everything the last session view computes from its matches"""
+    df = formatted(last_session)
+    team_session = session_details.team_rows(df, GAMERTAG)
+    coplay = session_details.coplay_counts(team_session)
+    outputs = {
+        "player_stats": session_details.player_stats(df, GAMERTAG),
+        "team_aggregated_stats": session_details.team_aggregated_stats(
+            team_session, coplay
+        ),
+        "squads_aggregated_stats": session_details.squads_aggregated_stats(df),
+        "lobby_kd_features": predict.pipeline_transform(last_session),
+    }
+    lobbies = match_details.lobby_analytics(df, GAMERTAG, LABELS)
+    outputs.update(
+        {f"lobby_analytics.{name}": table for name, table in lobbies.items()}
+    )
+    outputs["coplay_counts"] = coplay
+    return outputs
+
+
+def test_projection_keeps_what_the_app_reads():
+    projection = Projection.from_conf(CONF, "match")
+    assert projection is not None
+
+    last_session = load_sample("last_session")
+    projected = [
+        player
+        for match in utils.split_matches(last_session)
+        for player in projection.apply(match)
+    ]
+    expected = last_session_outputs(last_session)
+    result = last_session_outputs(projected)
+    for name, value in expected.items():
+        if isinstance(value, pd.DataFrame):
+            pd.testing.assert_frame_equal(result[name], value, obj=name)
+        else:
+            assert result[name] == value, name
@@ -0,0 +1,254 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from src.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    HedgePolicy,
+    is_permanent,
+    mark_sent,
+)
+from tests.conftest import settle, status_error
+
+"""
+Inside
+-----
+resilience.CircuitBreaker on a fake clock (conftest clock fixture) : closed / open / half-open transitions,
+a single trial request while half-open, 4xx client errors not counted as failures
+resilience.HedgePolicy against an httpx.MockTransport answering after given delays (real, short waits) : hedge sent
+after the latencies percentile, within budget, the slower request cancelled, latencies timed from mark_sent()
+"""
+
+
+async def request(breaker, error=None):
+    """one request through the breaker, failing with `error` if any"""
+    async with breaker:
+        if error is not None:
+            raise error
+
+
+async def fail(breaker, error):
+    with pytest.raises(type(error)):
+        await request(breaker, error)
+
+
+def test_circuit_breaker_transitions(clock):
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        for _ in range(2):
+            await fail(breaker, httpx.ConnectError("down"))
+        assert breaker.state == "closed"
+
+        await fail(breaker, status_error(503))
+        assert (breaker.state, breaker.trips) == ("open", 1)
+        with pytest.raises(CircuitOpenError):
+            await request(breaker)
+        assert breaker.rejected == 1
+
+        clock.advance(29)
+        assert breaker.state == "open"
+        clock.advance(1)
+        assert breaker.state == "half-open"
+
+        # failed trial : open again, for reset_timeout
+        await fail(breaker, status_error(429))
+        assert (breaker.state, breaker.trips) == ("open", 2)
+        clock.advance(30)
+
+        # successful trial : closed
+        await request(breaker)
+        assert breaker.stats() == {
+            "state": "closed",
+            "consecutive_failures": 0,
+            "trips": 2,
+            "rejected": 1,
+        }
+
+    asyncio.run(main())
+
+
+def test_success_resets_failures(clock):
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=3)
+        for _ in range(5):
+            await fail(breaker, httpx.ReadTimeout("slow"))
+            await fail(breaker, status_error(500))
+            await request(breaker)
+        assert (breaker.state, breaker.trips) == ("closed", 0)
+
+    asyncio.run(main())
+
+
+def test_retry_after_keeps_it_open(clock):
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        await fail(breaker, status_error(429, retry_after="120"))
+        clock.advance(30)
+        assert breaker.state == "open"
+        clock.advance(90)
+        assert breaker.state == "half-open"
+
+    asyncio.run(main())
+
+
+def test_single_trial_while_half_open(clock):
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        await fail(breaker, status_error(503))
+        clock.advance(30)
+
+        # the trial request is in flight : the others fail fast
+        trial = await breaker.__aenter__()
+        for _ in range(3):
+            with pytest.raises(CircuitOpenError):
+                await request(breaker)
+        assert breaker.rejected == 3
+
+        await trial.__aexit__(None, None, None)
+        assert breaker.state == "closed"
+        await request(breaker)
+
+    asyncio.run(main())
+
+
+def test_client_errors_not_counted(clock):
+    async def main():
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        for status in (400, 401, 403, 404, 404):
+            await fail(breaker, status_error(status))
+        assert (breaker.state, breaker.failures) == ("closed", 0)
+
+        # nor as a failed trial
+        await fail(breaker, status_error(503))
+        await fail(breaker, status_error(503))
+        clock.advance(30)
+        await fail(breaker, status_error(404))
+        assert (breaker.state, breaker.trips) == ("half-open", 1)
+
+    asyncio.run(main())
+
+
+def test_is_permanent():
+    assert is_permanent(status_error(404))
+    assert is_permanent(status_error(403))
+    assert not is_permanent(status_error(429))
+    assert not is_permanent(status_error(503))
+    assert not is_permanent(httpx.ConnectError("down"))
+
+
+class Upstream:
+    """httpx.MockTransport handler : answers the n-th request sent after delays[n] seconds"""
+
+    def __init__(self, *delays):
+        self.delays = delays
+        self.sent = []  # monotonic time each request was sent at
+        self.cancelled = []
+
+    async def __call__(self, request):
+        n = len(self.sent)
+        self.sent.append(time.monotonic())
+        try:
+            await asyncio.sleep(self.delays[n])
+        except asyncio.CancelledError:
+            self.cancelled.append(n)
+            raise
+        return httpx.Response(200, json={"request": n})
+
+
+def get_match(client, queued=0):
+    """--> coroutine function, as EnhancedApi GetMatch : waits `queued` seconds in the limits, then sends"""
+
+    async def fetch():
+        await asyncio.sleep(queued)
+        mark_sent()
+        response = await client.get("https://my.callofduty.com/api/papi-client/")
+        return response.json()["request"]
+
+    return fetch
+
+
+def hedging(delay, **kwargs):
+    """--> HedgePolicy, whose hedge delay is `delay` seconds"""
+    hedging = HedgePolicy(**kwargs)
+    hedging.latencies.extend([delay] * hedging.latencies.maxlen)
+    return hedging
+
+
+def test_hedge_delay():
+    hedging = HedgePolicy(percentile=95, min_samples=20)
+    hedging.latencies.extend([i / 100 for i in range(1, 20)])
+    assert hedging.delay() is None
+    hedging.latencies.append(0.2)
+    assert hedging.delay() == 0.2
+    hedging.percentile = 50
+    assert hedging.delay() == 0.11
+    assert hedging.stats()["hedge_delay"] == 0.11
+
+
+@pytest.mark.parametrize("delays, winner", [((1.0, 0.0), 1), ((0.2, 1.0), 0)])
+def test_first_reply_wins(delays, winner):
+    async def main():
+        upstream = Upstream(*delays)
+        policy = hedging(0.05)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as client:
+            assert await policy.run(get_match(client)) == winner
+            await settle()
+
+        # hedge sent once the percentile delay passed, without reply
+        assert len(upstream.sent) == 2
+        assert 0.05 <= upstream.sent[1] - upstream.sent[0] < 0.15
+        # the slower request is cancelled
+        assert upstream.cancelled == [1 - winner]
+        assert (policy.hedges, policy.hedge_wins) == (1, winner)
+
+    asyncio.run(main())
+
+
+def test_no_hedge_before_delay():
+    async def main():
+        upstream = Upstream(0.01)
+        policy = hedging(0.2)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as client:
+            assert await policy.run(get_match(client)) == 0
+        assert len(upstream.sent) == 1
+        assert policy.hedges == 0
+
+    asyncio.run(main())
+
+
+def test_hedge_budget():
+    async def main():
+        # every first request is slow, hedges are fast : hedging is only limited by the budget
+        upstream = Upstream(0.1, 0.0, 0.1, 0.1, 0.1, 0.1, 0.0, 0.1, 0.1, 0.1)
+        policy = hedging(0.02, budget=0.25)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as client:
+            for _ in range(8):
+                await policy.run(get_match(client))
+
+        # 25% budget of 8 requests : a hedge at the 1st request (0 < 0.25), the next one at the 5th (1 < 1.25)
+        assert len(upstream.sent) == 10
+        assert upstream.cancelled == [0, 5]
+        assert policy.stats()["hedges_pct"] == 25.0
+
+    asyncio.run(main())
+
+
+def test_latency_timed_from_send():
+    async def main():
+        upstream = Upstream(0.01, 0.01, 0.01)
+        policy = hedging(0.05)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(upstream)) as client:
+            # concurrent attempts, each with its own send time (contextvar set per attempt)
+            results = await asyncio.gather(
+                *(policy.run(get_match(client, queued=q)) for q in (0.1, 0.2, 0.3))
+            )
+
+        # waiting in the queues is not latency : no hedge, latencies of the replies only
+        assert sorted(results) == [0, 1, 2]
+        assert policy.hedges == 0
+        assert all(0.01 <= latency < 0.05 for latency in list(policy.latencies)[-3:])
+
+    asyncio.run(main())
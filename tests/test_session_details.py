@@ -0,0 +1,45 @@
+from src import session_details
+from tests.conftest import GAMERTAG, formatted, load_sample
+
+"""
+Inside
+-----
+Team stats of data/sample_last_session.pkl pinned : teammates rows are gamertag's teams rows only (team_rows),
+played is the number of matches played together
+"""
+
+
+def test_coplay_counts():
+    team_session = session_details.team_rows(
+        formatted(load_sample("last_session")), GAMERTAG
+    )
+    assert session_details.coplay_counts(team_session) == {
+        "beapierre": 1,
+        "clarkey_efc10": 1,
+        "gentil_renard": 5,
+        "Hugob_33": 1,
+        "Kevin551316": 1,
+        "Kidjz_died": 1,
+        "LoveNuoX": 1,
+        "Nag _1 _": 1,
+        "raffysenegalese-": 1,
+        "Riley-Roo-81": 1,
+    }
+
+
+def test_team_aggregated_stats():
+    team_session = session_details.team_rows(
+        formatted(load_sample("last_session")), GAMERTAG
+    )
+    team_stats = session_details.team_aggregated_stats(
+        team_session, session_details.coplay_counts(team_session)
+    )
+    # Kidjz_died played 2 matches of the session, but only 1 in gamertag's team
+    assert team_stats[
+        ["username", "played", "kills", "deaths", "loadoutBest"]
+    ].values.tolist() == [
+        ["gentil_renard", 5, 4, 10, "Einhorn ZRG"],
+        ["beapierre", 1, 1, 4, "Grau_5.56 MP5mw"],
+        ["clarkey_efc10", 1, 2, 2, "RA-225 me_katana"],
+        ["Hugob_33", 1, 1, 5, "ar_falpha MP40"],
+    ]